@@ -3,20 +3,27 @@
 Backend Flask para el Dashboard de Medición de IAs
 """
 
-from flask import Flask, render_template, jsonify, request
+import sys
+import time
+_startup_begin = time.perf_counter()
+
+import importlib
+from flask import Flask, render_template, jsonify, request, Response
 from flask_cors import CORS
 import json
-import time
+import hashlib
 import os
+import subprocess
+import tempfile
+import threading
+import uuid
 import requests
-from datetime import datetime
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import firestore
-from groq import Groq
-from openai import OpenAI
-from google import generativeai as genai
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
 from dotenv import load_dotenv
+import work_queue
 
 # Cargar variables de entorno
 load_dotenv()
@@ -24,8 +31,6 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
-# Configuración de API Keys
-# Configuración de API Keys
 # Configuración de API Keys
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
@@ -34,33 +39,69 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 def inject_firebase_key():
     return dict(firebase_api_key=os.getenv("FIREBASE_API_KEY"))
 
-# Inicialización de Firebase
-# Inicialización de Firebase
-try:
-    # Intenta cargar desde archivo local (desarrollo)
-    if os.path.exists("serviceAccountKey.json"):
-        cred = credentials.Certificate("serviceAccountKey.json")
-    # Intenta cargar desde variable de entorno (producción/Vercel)
-    elif os.getenv("FIREBASE_SERVICE_ACCOUNT"):
-        # La variable de entorno debe contener el JSON completo como string
-        # En Vercel, a veces es mejor usar base64 si hay problemas con saltos de línea,
-        # pero JSON string directo suele funcionar si se copia con cuidado.
-        service_account_info = json.loads(os.getenv("FIREBASE_SERVICE_ACCOUNT"))
-        cred = credentials.Certificate(service_account_info)
-    else:
-        raise Exception("No se encontró serviceAccountKey.json ni variable FIREBASE_SERVICE_ACCOUNT")
-        
-    firebase_admin.initialize_app(cred)
-    db = firestore.client()
-    print("Firebase inicializado correctamente.")
-except Exception as e:
-    print(f"Error al inicializar Firebase: {e}")
-    # Si falla, intentamos conectar sin credenciales explícitas (ej. si estamos en Google Cloud environment)
-    # o simplemente dejamos que falle más tarde si no hay auth
-    try:
-        db = firestore.client()
-    except:
-        print("No se pudo conectar a Firestore.")
+# Inicialización perezosa: los SDKs de los providers y Firebase no se cargan al
+# importar app.py (cold start en Vercel) sino en el primer uso, y se reutilizan.
+_lazy_timings = {}  # nombre -> segundos que tardó la carga en el primer uso
+_db = None
+_db_lock = threading.Lock()
+
+# Direcciones de ordenación (equivalentes a firestore.Query.ASCENDING/DESCENDING)
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+def lazy_import(module_name):
+    """Importa un módulo en el primer uso y registra cuánto tardó"""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    _lazy_timings.setdefault(module_name, round(time.perf_counter() - start, 4))
+    return module
+
+def get_db():
+    """Cliente de Firestore, inicializado en el primer acceso a datos"""
+    global _db
+    if _db is not None:
+        return _db
+
+    with _db_lock:
+        if _db is not None:
+            return _db
+
+        start = time.perf_counter()
+        firebase_admin = lazy_import('firebase_admin')
+        credentials = lazy_import('firebase_admin.credentials')
+        firestore = lazy_import('firebase_admin.firestore')
+
+        # Inicialización de Firebase
+        try:
+            # Intenta cargar desde archivo local (desarrollo)
+            if os.path.exists("serviceAccountKey.json"):
+                cred = credentials.Certificate("serviceAccountKey.json")
+            # Intenta cargar desde variable de entorno (producción/Vercel)
+            elif os.getenv("FIREBASE_SERVICE_ACCOUNT"):
+                # La variable de entorno debe contener el JSON completo como string
+                # En Vercel, a veces es mejor usar base64 si hay problemas con saltos de línea,
+                # pero JSON string directo suele funcionar si se copia con cuidado.
+                service_account_info = json.loads(os.getenv("FIREBASE_SERVICE_ACCOUNT"))
+                cred = credentials.Certificate(service_account_info)
+            else:
+                raise Exception("No se encontró serviceAccountKey.json ni variable FIREBASE_SERVICE_ACCOUNT")
+
+            if not firebase_admin._apps:
+                firebase_admin.initialize_app(cred)
+            db = firestore.client()
+            print("Firebase inicializado correctamente.")
+        except Exception as e:
+            print(f"Error al inicializar Firebase: {e}")
+            # Si falla, intentamos conectar sin credenciales explícitas (ej. si estamos en Google Cloud environment)
+            # Si tampoco funciona, el error se propaga y se reintenta en el siguiente acceso
+            db = firestore.client()
+
+        _lazy_timings['firestore_client'] = round(time.perf_counter() - start, 4)
+        _db = db
+        return _db
 
 
 # Configuración de API Keys
@@ -68,6 +109,38 @@ OPEN_ROUTER_KEY = os.getenv("OPEN_ROUTER_KEY")
 PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Vista materializada keyword_performance: un documento por
+# (query, pregunta, keyword, modelo) que se actualiza en cada escritura
+KP_HISTORY_SIZE = int(os.getenv("KP_HISTORY_SIZE", "50"))
+KP_ROLLING_WINDOW = int(os.getenv("KP_ROLLING_WINDOW", "10"))
+
+# Retención: a los resultados con más de RETENTION_RAW_DAYS días se les quita el
+# texto de la respuesta ("drop") o se mueve a tracking_results_archive
+# ("archive"); el resultado puntuado se conserva. RETENTION_RAW_DAYS=0 lo desactiva.
+RETENTION_RAW_DAYS = int(os.getenv("RETENTION_RAW_DAYS", "90"))
+RETENTION_MODE = os.getenv("RETENTION_MODE", "drop")
+RETENTION_PAGE_SIZE = 200  # en modo archive son 2 escrituras por resultado (máx. 500 por batch)
+# Los resultados con más de RETENTION_ROW_DAYS días se suman a daily_aggregates
+# (un documento por día, query, keyword y modelo) y se borran; gráficos y
+# ranking leen esos agregados. RETENTION_ROW_DAYS=0 conserva las filas siempre.
+RETENTION_ROW_DAYS = int(os.getenv("RETENTION_ROW_DAYS", "365"))
+QUEUE_RETENTION_DAYS = int(os.getenv("QUEUE_RETENTION_DAYS", "7"))
+
+# Control de admisión del tracking: una ejecución en curso por query (las
+# peticiones duplicadas responden 202 al momento), un máximo de ejecuciones simultáneas
+# y una cola de espera acotada; si está llena se responde 429 con Retry-After.
+MAX_CONCURRENT_RUNS = int(os.getenv("MAX_CONCURRENT_RUNS", "2"))
+MAX_QUEUED_RUNS = int(os.getenv("MAX_QUEUED_RUNS", "4"))
+RUN_QUEUE_TIMEOUT = float(os.getenv("RUN_QUEUE_TIMEOUT", "30"))
+RUN_RETRY_AFTER = int(os.getenv("RUN_RETRY_AFTER", "30"))
+
+_maintenance_jobs = {}  # job_id -> estado de la tarea en segundo plano
+_maintenance_lock = threading.Lock()
+
+# Modo de ejecución del tracking: "inline" (en el proceso de Flask) o "queue"
+# (se encola en la cola compartida y lo procesan los workers: python -m worker)
+TRACKING_MODE = os.getenv("TRACKING_MODE", "inline")
+
 # Modelos disponibles
 # Modelos disponibles
 AVAILABLE_MODELS = [
@@ -132,20 +205,52 @@ AVAILABLE_MODELS = [
             "max_completion_tokens": 4096,
             "top_p": 1,
             "reasoning_effort": "medium"
-        }
+        },
+        "deadline": 90,
+        "fallback": "openai/gpt-5.2-chat"
     },
     {"id": "gemini-2.0-flash", "name": "Gemini 2.0 Flash", "provider": "google"},
     {"id": "deepseek-chat", "name": "DeepSeek Chat", "provider": "openrouter"},
-    {"id": "openai/gpt-5.2-chat", "name": "GPT 5.2 (via OpenRouter)", "provider": "openrouter"},
+    {"id": "openai/gpt-5.2-chat", "name": "GPT 5.2 (via OpenRouter)", "provider": "openrouter", "fallback": "gpt-5.2"},
     {"id": "sonar-pro", "name": "Perplexity Sonar Pro", "provider": "perplexity"},
-    {"id": "sonar-reasoning-pro", "name": "Perplexity Sonar Reasoning Pro", "provider": "perplexity"}
+    {"id": "sonar-reasoning-pro", "name": "Perplexity Sonar Reasoning Pro", "provider": "perplexity", "deadline": 90}
 ]
 
+# Hedging de peticiones: si una llamada supera el p95 de latencia de su modelo
+# se lanza una petición de respaldo y nos quedamos con la primera que responda.
+# "deadline" (segundos) es el presupuesto total por modelo y "fallback" el id de
+# un modelo equivalente en otro provider.
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "10"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "2"))
+MODEL_DEADLINE = float(os.getenv("MODEL_DEADLINE", "60"))
+# Presupuesto mínimo para empezar una llamada: con menos no da tiempo a responder
+MODEL_MIN_BUDGET = float(os.getenv("MODEL_MIN_BUDGET", "1"))
+
+_hedge_executor = ThreadPoolExecutor(max_workers=int(os.getenv("HEDGE_MAX_WORKERS", "16")),
+                                     thread_name_prefix="hedge")
+_latency_lock = threading.Lock()
+_model_latencies = {}  # model_id -> deque con las últimas latencias correctas
+
+# Circuit breaker por provider: si la tasa de error o de llamadas lentas en la
+# ventana reciente supera el umbral se abre y las llamadas fallan al instante.
+# Tras BREAKER_COOLDOWN segundos pasa a half-open y deja pasar llamadas de prueba.
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "300"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_CALL = float(os.getenv("BREAKER_SLOW_CALL", "45"))
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.8"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "60"))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "2"))
 
 
-def query_groq(model, prompt, api_key, params=None):
+
+def query_groq(model, prompt, api_key, params=None, timeout=60):
     """Consulta a un modelo Groq con parámetros personalizados"""
-    client = Groq(api_key=api_key)
+    client = lazy_import('groq').Groq(api_key=api_key, timeout=timeout)
     
     # Parámetros por defecto
     request_params = {
@@ -178,12 +283,13 @@ def query_groq(model, prompt, api_key, params=None):
         raise ValueError("Respuesta vacía o nula")
     return content, elapsed, []
 
-def query_gemini(prompt, api_key):
+def query_gemini(prompt, api_key, timeout=60):
     """Consulta a Gemini"""
+    genai = lazy_import('google.generativeai')
     genai.configure(api_key=api_key)
     model = genai.GenerativeModel("gemini-2.0-flash")
     start = time.time()
-    response = model.generate_content(prompt)
+    response = model.generate_content(prompt, request_options={'timeout': timeout})
     elapsed = round(time.time() - start, 3)
     citations = []
     if hasattr(response, "text") and response.text:
@@ -199,7 +305,7 @@ def query_gemini(prompt, api_key):
         raise ValueError("Respuesta vacía o nula en Gemini")
     return content, elapsed, citations
 
-def query_openrouter(model, prompt, api_key):
+def query_openrouter(model, prompt, api_key, timeout=60):
     """Consulta a un modelo a través de OpenRouter"""
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -213,7 +319,7 @@ def query_openrouter(model, prompt, api_key):
     }
     start = time.time()
     response = requests.post("https://openrouter.ai/api/v1/chat/completions", 
-                           headers=headers, json=data, timeout=60)
+                           headers=headers, json=data, timeout=timeout)
     elapsed = round(time.time() - start, 3)
     response.raise_for_status()
     result = response.json()
@@ -222,9 +328,9 @@ def query_openrouter(model, prompt, api_key):
         raise ValueError("Respuesta vacía o nula")
     return content, elapsed, []
 
-def query_openai(model, prompt, api_key, params=None):
+def query_openai(model, prompt, api_key, params=None, timeout=60):
     """Consulta a un modelo OpenAI"""
-    client = OpenAI(api_key=api_key)
+    client = lazy_import('openai').OpenAI(api_key=api_key, timeout=timeout)
     
     # Parámetros por defecto
     request_params = {
@@ -247,9 +353,9 @@ def query_openai(model, prompt, api_key, params=None):
     content = chat_completion.choices[0].message.content
     if not content or content.strip() == "":
         raise ValueError("Respuesta vacía o nula")
-    return content, elapsed
+    return content, elapsed, []
 
-def query_perplexity(model, prompt, api_key):
+def query_perplexity(model, prompt, api_key, timeout=60):
     """Consulta a un modelo Perplexity"""
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -263,7 +369,7 @@ def query_perplexity(model, prompt, api_key):
     }
     start = time.time()
     response = requests.post("https://api.perplexity.ai/chat/completions", 
-                           headers=headers, json=data, timeout=60)
+                           headers=headers, json=data, timeout=timeout)
     elapsed = round(time.time() - start, 3)
     response.raise_for_status()
     result = response.json()
@@ -273,6 +379,364 @@ def query_perplexity(model, prompt, api_key):
         raise ValueError("Respuesta vacía o nula")
     return content, elapsed, citations
 
+class ProviderUnavailableError(Exception):
+    """El circuit breaker del provider está abierto"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after  # segundos hasta que vuelva a admitir llamadas
+
+
+class CircuitBreaker:
+    """Circuit breaker de un provider basado en errores y latencia recientes"""
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.state = 'closed'
+        self.opened_at = None
+        self.trial_calls = 0
+        self.trial_successes = 0
+        self.calls = deque(maxlen=BREAKER_WINDOW)  # (timestamp, ok, slow, elapsed)
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Indica si se puede llamar al provider (reserva una llamada de prueba en half-open)"""
+        with self.lock:
+            if self.state == 'open':
+                if time.time() - self.opened_at < BREAKER_COOLDOWN:
+                    return False
+                self.state = 'half_open'
+                self.trial_calls = 0
+                self.trial_successes = 0
+            if self.state == 'half_open':
+                if self.trial_calls >= BREAKER_HALF_OPEN_CALLS:
+                    return False
+                self.trial_calls += 1
+            return True
+
+    def record(self, ok, elapsed):
+        """Registra el resultado de una llamada y actualiza el estado"""
+        slow = elapsed is not None and elapsed > BREAKER_SLOW_CALL
+        with self.lock:
+            self.calls.append((time.time(), ok, slow, elapsed))
+            if self.state == 'half_open':
+                if ok and not slow:
+                    self.trial_successes += 1
+                    if self.trial_successes >= BREAKER_HALF_OPEN_CALLS:
+                        self.state = 'closed'
+                        self.calls.clear()
+                else:
+                    self._open()
+            elif self.state == 'closed':
+                error_rate, slow_rate, count = self._rates()
+                if count >= BREAKER_MIN_CALLS and (error_rate >= BREAKER_ERROR_RATE or slow_rate >= BREAKER_SLOW_RATE):
+                    self._open()
+
+    def release(self):
+        """Devuelve una llamada de prueba cuyo resultado se descartó sin registrarlo"""
+        with self.lock:
+            if self.state == 'half_open' and self.trial_calls > 0:
+                self.trial_calls -= 1
+
+    def retry_in(self):
+        """Segundos que quedan de cooldown (None si no está abierto)"""
+        with self.lock:
+            return self._retry_in()
+
+    def _retry_in(self):
+        if self.state != 'open':
+            return None
+        return max(0, round(BREAKER_COOLDOWN - (time.time() - self.opened_at), 1))
+
+    def _open(self):
+        self.state = 'open'
+        self.opened_at = time.time()
+        print(f"Circuit breaker abierto para {self.provider}")
+
+    def _rates(self):
+        cutoff = time.time() - BREAKER_WINDOW_SECONDS
+        recent = [c for c in self.calls if c[0] >= cutoff]
+        if not recent:
+            return 0.0, 0.0, 0
+        errors = sum(1 for c in recent if not c[1])
+        slow = sum(1 for c in recent if c[2])
+        return errors / len(recent), slow / len(recent), len(recent)
+
+    def snapshot(self):
+        """Estado actual para el endpoint de salud"""
+        with self.lock:
+            error_rate, slow_rate, count = self._rates()
+            latencies = sorted(c[3] for c in self.calls if c[1] and c[3] is not None)
+            retry_in = self._retry_in()
+            return {
+                'provider': self.provider,
+                'state': self.state,
+                'recent_calls': count,
+                'error_rate': round(error_rate, 3),
+                'slow_rate': round(slow_rate, 3),
+                'p95_latency': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+                'opened_at': datetime.fromtimestamp(self.opened_at).isoformat() if self.opened_at else None,
+                'retry_in': retry_in
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(provider):
+    """Devuelve (creándolo si hace falta) el circuit breaker de un provider"""
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(provider)
+        return _breakers[provider]
+
+class AdmissionRejected(Exception):
+    """No hay capacidad para admitir otra ejecución de tracking"""
+
+    def __init__(self, message, retry_after=RUN_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TrackingAdmission:
+    """Control de admisión de ejecuciones de tracking"""
+
+    def __init__(self, max_running, max_queued):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.running = 0
+        self.queued = 0
+        self.in_flight = {}  # query_id -> ejecución en curso o en espera
+        self.cond = threading.Condition()
+
+    def submit(self, query_id, target, queue_timeout=RUN_QUEUE_TIMEOUT):
+        """Ejecuta target() para la query respetando los límites.
+
+        Si ya hay una ejecución de la query devuelve (run, True) sin esperar a que
+        termine; si no, la ejecuta en este hilo y devuelve (run, False). run es un
+        dict con 'done' (Event), 'result' y 'error'.
+        """
+        with self.cond:
+            run = self.in_flight.get(query_id)
+            if run:
+                return run, True
+
+            if self.running >= self.max_running and self.queued >= self.max_queued:
+                raise AdmissionRejected('Demasiadas ejecuciones de tracking en curso')
+
+            run = {'done': threading.Event(), 'result': None, 'error': None}
+            self.in_flight[query_id] = run
+
+            if self.running >= self.max_running:
+                self.queued += 1
+                deadline = time.monotonic() + queue_timeout
+                while self.running >= self.max_running:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                self.queued -= 1
+
+                if self.running >= self.max_running:
+                    del self.in_flight[query_id]
+                    run['error'] = AdmissionRejected('Tiempo de espera en cola agotado')
+                    run['done'].set()
+                    raise run['error']
+
+            self.running += 1
+
+        try:
+            run['result'] = target()
+        except Exception as e:
+            run['error'] = e
+        finally:
+            with self.cond:
+                self.running -= 1
+                self.in_flight.pop(query_id, None)
+                self.cond.notify()
+            run['done'].set()
+        return run, False
+
+    def snapshot(self):
+        with self.cond:
+            return {
+                'running': self.running,
+                'queued': self.queued,
+                'max_running': self.max_running,
+                'max_queued': self.max_queued,
+                'in_flight': list(self.in_flight)
+            }
+
+
+tracking_admission = TrackingAdmission(MAX_CONCURRENT_RUNS, MAX_QUEUED_RUNS)
+_track_all_lock = threading.Lock()
+
+def too_many_requests(message, retry_after=RUN_RETRY_AFTER):
+    """Respuesta 429 con cabecera Retry-After"""
+    response = jsonify({'error': message, 'retry_after': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def get_model_info(model_id):
+    """Busca un modelo en la lista de disponibles"""
+    return next((m for m in AVAILABLE_MODELS if m['id'] == model_id), None)
+
+def record_latency(model_id, elapsed):
+    """Registra la latencia de una llamada correcta para calcular percentiles"""
+    with _latency_lock:
+        if model_id not in _model_latencies:
+            _model_latencies[model_id] = deque(maxlen=100)
+        _model_latencies[model_id].append(elapsed)
+
+def get_hedge_delay(model_id):
+    """Segundos a esperar antes de lanzar la petición de respaldo (p95 del modelo)"""
+    with _latency_lock:
+        samples = sorted(_model_latencies.get(model_id, []))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    idx = min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE))
+    return max(HEDGE_MIN_DELAY, samples[idx])
+
+def call_model(model_info, prompt, timeout, discarded=None):
+    """Consulta un modelo según su provider. Devuelve (response, elapsed, sources)
+
+    Si `discarded` (threading.Event) está activo al terminar, la llamada perdió el
+    hedging y no se registra en el circuit breaker ni en las latencias.
+    """
+    model_id = model_info['id']
+    provider = model_info['provider']
+
+    breaker = get_breaker(provider)
+    if not breaker.allow():
+        raise ProviderUnavailableError(f"Provider {provider} no disponible (circuit breaker abierto)",
+                                       breaker.retry_in())
+
+    start = time.time()
+    try:
+        result = _dispatch_model(model_info, prompt, timeout)
+    except Exception:
+        if discarded is not None and discarded.is_set():
+            breaker.release()
+        else:
+            breaker.record(False, round(time.time() - start, 3))
+        raise
+    if discarded is not None and discarded.is_set():
+        breaker.release()
+        return result
+    breaker.record(True, result[1])
+    record_latency(model_id, result[1])
+    return result
+
+def _dispatch_model(model_info, prompt, timeout):
+    """Llama a la función del provider correspondiente"""
+    model_id = model_info['id']
+    provider = model_info['provider']
+
+    if provider == 'groq':
+        # Extraer parámetros específicos del modelo si existen
+        params = model_info.get('params', {})
+        result = query_groq(model_id, prompt, GROQ_API_KEY, params, timeout=timeout)
+    elif provider == 'openai':
+        params = model_info.get('params', {})
+        result = query_openai(model_id, prompt, OPENAI_API_KEY, params, timeout=timeout)
+    elif provider == 'google':
+        result = query_gemini(prompt, GOOGLE_API_KEY, timeout=timeout)
+    elif provider == 'openrouter':
+        # Mapear el modelo de openrouter
+        openrouter_model = "deepseek/deepseek-chat" if model_id == "deepseek-chat" else model_id
+        result = query_openrouter(openrouter_model, prompt, OPEN_ROUTER_KEY, timeout=timeout)
+    elif provider == 'perplexity':
+        result = query_perplexity(model_id, prompt, PERPLEXITY_API_KEY, timeout=timeout)
+    else:
+        raise ValueError(f"Provider no soportado: {provider}")
+    return result
+
+def call_model_before_deadline(model_info, prompt, deadline, discarded=None):
+    """Llama al modelo con el tiempo que queda hasta el deadline al empezar a ejecutarse.
+
+    Si la llamada esperó en el executor hasta pasar el deadline (o queda menos de
+    MODEL_MIN_BUDGET) ya no se hace, así ninguna llamada se pasa del deadline.
+    """
+    remaining = deadline - time.monotonic()
+    if remaining < MODEL_MIN_BUDGET:
+        raise TimeoutError(f"Deadline superado antes de llamar a {model_info['id']}")
+    return call_model(model_info, prompt, remaining, discarded)
+
+def query_model(model_id, prompt):
+    """Consulta un modelo respetando su deadline, con hedging y fallback opcional.
+
+    Si la llamada supera el p95 de latencia del modelo se lanza una petición de
+    respaldo (al modelo de fallback si existe, si no al mismo modelo) y se usa la
+    primera respuesta. Si todas las llamadas fallan se prueba el fallback.
+    Devuelve (response, elapsed, sources, served_by).
+    """
+    model_info = get_model_info(model_id)
+    if not model_info:
+        raise ValueError(f"Modelo no disponible: {model_id}")
+    fallback_info = get_model_info(model_info['fallback']) if model_info.get('fallback') else None
+
+    start = time.monotonic()
+    deadline = start + model_info.get('deadline', MODEL_DEADLINE)
+    futures = {}  # future -> id del modelo que la atiende
+    # Se activa cuando una llamada gana: las demás ya no cuentan para el breaker
+    discarded = threading.Event()
+
+    def launch(info):
+        future = _hedge_executor.submit(call_model_before_deadline, info, prompt, deadline, discarded)
+        futures[future] = info['id']
+
+    launch(model_info)
+    hedged = not HEDGE_ENABLED
+    fallback_used = fallback_info is None
+    last_error = None
+
+    try:
+        while futures:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            timeout = remaining if hedged else min(remaining, get_hedge_delay(model_id))
+            done, _ = wait(list(futures), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                if hedged:
+                    continue
+                # La llamada va por la cola de latencia: lanzamos el respaldo
+                hedged = True
+                if not fallback_used:
+                    fallback_used = True
+                    launch(fallback_info)
+                else:
+                    launch(model_info)
+                continue
+
+            for future in done:
+                served_by = futures.pop(future)
+                try:
+                    response, _, sources = future.result()
+                except Exception as e:
+                    print(f"Error en {served_by}: {e}")
+                    last_error = e
+                    continue
+                discarded.set()
+                return response, round(time.monotonic() - start, 3), sources, served_by
+
+            if not futures and not fallback_used:
+                fallback_used = True
+                hedged = True
+                launch(fallback_info)
+    finally:
+        # Las llamadas que ya están en curso no se pueden interrumpir, pero su
+        # timeout está acotado por el deadline y, si otra ganó, su resultado se
+        # descarta sin contar como error ni como latencia del provider
+        for future in futures:
+            future.cancel()
+
+    if last_error and not futures:
+        raise last_error
+    raise TimeoutError(f"Deadline de {model_info.get('deadline', MODEL_DEADLINE)}s superado para {model_id}")
+
 def find_keyword_position(response, keyword):
     """Encuentra la posición de una keyword basada en el número de párrafo (1-indexado)"""
     response_lower = response.lower()
@@ -309,6 +773,450 @@ def calculate_visibility(response, keyword):
 
 
 
+def plan_tracking(query_data):
+    """Expande preguntas × keywords × modelos en work items (modelo, prompt) únicos.
+
+    Una pregunta sin placeholder {keyword} genera el mismo prompt para todas las
+    keywords, así que se consulta una sola vez y todas se puntúan sobre esa
+    respuesta. Cada work item guarda en 'targets' las combinaciones
+    (idioma, pregunta, keyword) que comparten ese prompt.
+    """
+    keywords = query_data.get('keywords', [])
+    prompts = query_data.get('prompts', {})
+    model_ids = [m for m in query_data.get('models', []) if get_model_info(m)]
+
+    items = {}  # (model_id, prompt) -> work item
+    # Cada línea del prompt es una pregunta separada
+    for language, prompt_template in prompts.items():
+        question_lines = [line.strip() for line in prompt_template.split('\n') if line.strip()]
+
+        for question_text in question_lines:
+            for keyword in keywords:
+                # Reemplazar placeholder {keyword} en la pregunta
+                prompt = question_text.replace('{keyword}', keyword)
+                target = {'language': language, 'question_text': question_text, 'keyword': keyword}
+
+                for model_id in model_ids:
+                    key = (model_id, prompt)
+                    if key not in items:
+                        items[key] = {'model_id': model_id, 'prompt': prompt, 'targets': []}
+                    if target not in items[key]['targets']:
+                        items[key]['targets'].append(target)
+
+    return list(items.values())
+
+def score_competitors(response, competitors):
+    """Posición y visibilidad de cada competidor en una respuesta"""
+    return {
+        competitor: {
+            'position': find_keyword_position(response, competitor),
+            'visibility': calculate_visibility(response, competitor)
+        }
+        for competitor in competitors
+    }
+
+def execute_work_item(query_id, item, competitors=None):
+    """Consulta el modelo una vez para un work item y guarda un resultado por target"""
+    model_id = item['model_id']
+    prompt = item['prompt']
+    results = []
+
+    try:
+        print(f"DEBUG: Consultando modelo {model_id} para {len(item['targets'])} keyword(s)...")
+        # Consultar con deadline, hedging y fallback
+        response, elapsed, sources, served_by = query_model(model_id, prompt)
+    except Exception as e:
+        print(f"Error tracking '{prompt}' on {model_id}: {e}")
+        # Con el breaker abierto no se llegó a llamar: los workers lo reintentan sin gastar intento
+        unavailable = isinstance(e, ProviderUnavailableError)
+        return [{
+            'keyword': target['keyword'],
+            'model': model_id,
+            'question': target['question_text'],
+            'error': str(e),
+            'provider_unavailable': unavailable,
+            'retry_after': e.retry_after if unavailable else None,
+            'success': False
+        } for target in item['targets']]
+
+    competitor_metrics = score_competitors(response, competitors or [])
+
+    for target in item['targets']:
+        keyword = target['keyword']
+        try:
+            # Calcular posición y visibilidad
+            position = find_keyword_position(response, keyword)
+            visibility = calculate_visibility(response, keyword)
+
+            # Guardar resultado en Firestore
+            result_data = {
+                'query_id': query_id,
+                'keyword': keyword,
+                'model_id': model_id,
+                'prompt_text': prompt,
+                'question_text': target['question_text'],
+                'language': target['language'],
+                'response_text': response,
+                'sources': sources, # Guardar fuentes
+                'served_by': served_by, # Modelo que respondió (puede ser el fallback)
+                'elapsed': elapsed,
+                'position': position,
+                'visibility': visibility,
+                'competitor_metrics': competitor_metrics,
+                'tracked_at': datetime.now()
+            }
+
+            store_result(result_data)
+
+            results.append({
+                'keyword': keyword,
+                'model': model_id,
+                'question': target['question_text'],
+                'position': position,
+                'visibility': visibility,
+                'success': True
+            })
+        except Exception as e:
+            print(f"Error tracking {keyword} on {model_id}: {e}")
+            results.append({
+                'keyword': keyword,
+                'model': model_id,
+                'question': target['question_text'],
+                'error': str(e),
+                'success': False
+            })
+
+    return results
+
+def _as_naive(dt):
+    """Firestore devuelve fechas con zona horaria; las comparamos como UTC sin zona"""
+    if isinstance(dt, datetime) and dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def _average(values):
+    return round(sum(values) / len(values), 2) if values else None
+
+def performance_doc_id(query_id, question_text, keyword, model_id):
+    """Id determinista del documento de keyword_performance"""
+    key = json.dumps([query_id, question_text, keyword, model_id])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def build_performance_row(result_data, history, result_count):
+    """Calcula la fila materializada a partir del histórico reciente (orden ascendente)"""
+    latest = history[-1]
+    # Valor de hace 24h: el último punto registrado al menos 24h antes del actual
+    cutoff = latest['tracked_at'] - timedelta(hours=24)
+    previous = next((h for h in reversed(history) if h['tracked_at'] <= cutoff), None)
+
+    position_change = None
+    visibility_change = None
+    if previous:
+        if latest['position'] is not None and previous['position'] is not None:
+            position_change = latest['position'] - previous['position']
+        visibility_change = round((latest['visibility'] or 0) - (previous['visibility'] or 0), 2)
+
+    rolling = history[-KP_ROLLING_WINDOW:]
+
+    return {
+        'query_id': result_data['query_id'],
+        'question_text': result_data['question_text'],
+        'language': result_data.get('language'),
+        'keyword': result_data['keyword'],
+        'model_id': result_data['model_id'],
+        'latest_result_id': latest.get('result_id'),
+        'latest_tracked_at': latest['tracked_at'],
+        'latest_position': latest['position'],
+        'latest_visibility': latest['visibility'],
+        'latest_sources': result_data.get('sources', []) if latest.get('result_id') == result_data.get('result_id') else None,
+        'position_24h_ago': previous['position'] if previous else None,
+        'visibility_24h_ago': previous['visibility'] if previous else None,
+        'position_change_24h': position_change,
+        'visibility_change_24h': visibility_change,
+        'avg_position': _average([h['position'] for h in rolling if h['position'] is not None]),
+        'avg_visibility': _average([h['visibility'] or 0 for h in rolling]),
+        'result_count': result_count,
+        'history': history,
+        'updated_at': datetime.now()
+    }
+
+def _history_point(result_data):
+    return {
+        'result_id': result_data.get('result_id'),
+        'tracked_at': _as_naive(result_data['tracked_at']),
+        'position': result_data.get('position'),
+        'visibility': result_data.get('visibility')
+    }
+
+def _update_performance_in_transaction(transaction, ref, result_data):
+    snapshot = ref.get(transaction=transaction)
+    row = snapshot.to_dict() if snapshot.exists else {}
+
+    history = row.get('history', [])
+    for h in history:
+        h['tracked_at'] = _as_naive(h['tracked_at'])
+    history.append(_history_point(result_data))
+    history.sort(key=lambda h: h['tracked_at'])
+    history = history[-KP_HISTORY_SIZE:]
+
+    new_row = build_performance_row(result_data, history, row.get('result_count', 0) + 1)
+    if new_row['latest_sources'] is None:
+        # El resultado recibido llegó tarde y no es el más reciente
+        new_row['latest_sources'] = row.get('latest_sources', [])
+    transaction.set(ref, new_row)
+
+def update_keyword_performance(result_data):
+    """Actualiza la vista materializada con un nuevo resultado"""
+    doc_id = performance_doc_id(result_data['query_id'], result_data['question_text'],
+                                result_data['keyword'], result_data['model_id'])
+    ref = get_db().collection('keyword_performance').document(doc_id)
+    firestore = lazy_import('firebase_admin.firestore')
+    firestore.transactional(_update_performance_in_transaction)(get_db().transaction(), ref, result_data)
+
+def normalize_domain(url):
+    """Normaliza una URL citada a su dominio (sin www, puerto ni credenciales)"""
+    if not url or not isinstance(url, str):
+        return None
+    url = url.strip()
+    if '//' not in url:
+        url = '//' + url
+    try:
+        host = urlparse(url).hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+    host = host.lower().rstrip('.')
+    if any(c.isspace() for c in host):
+        return None
+    if host.startswith('www.'):
+        host = host[4:]
+    return host or None
+
+def source_index_entry(result_data):
+    """Entrada del índice invertido dominio -> resultado"""
+    tracked_at = _as_naive(result_data['tracked_at'])
+    return {
+        'result_id': result_data['result_id'],
+        'query_id': result_data['query_id'],
+        'keyword': result_data['keyword'],
+        'model_id': result_data['model_id'],
+        'mentioned': (result_data.get('visibility') or 0) > 0,
+        'tracked_at': tracked_at
+    }
+
+# Campo del documento de dominio para cada dimensión de source_rankings
+SOURCE_FIELDS = {
+    'keyword': 'by_keyword',
+    'model': 'by_model',
+    'query': 'by_query',
+    'day': 'by_day',
+    'brand': 'brand_mentions'
+}
+SOURCE_RESULTS = 'source_results'  # subcolección de cada dominio con el índice invertido
+
+def source_dimensions(entry):
+    """(dimensión, valor) en los que cuenta una entrada del índice de fuentes"""
+    dimensions = [
+        ('keyword', entry['keyword']),
+        ('model', entry['model_id']),
+        ('query', entry['query_id']),
+        ('day', _as_naive(entry['tracked_at']).strftime('%Y-%m-%d'))
+    ]
+    if entry['mentioned']:
+        dimensions.append(('brand', entry['keyword']))
+    return dimensions
+
+def source_ranking_ref(dimension, value):
+    """Documento de source_rankings con los contadores por dominio de (dimensión, valor)"""
+    key = json.dumps([dimension, value])
+    return get_db().collection('source_rankings').document(hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+def update_source_index(result_data):
+    """Añade las fuentes citadas de un resultado al índice de fuentes.
+
+    Por cada dominio se escribe su entrada en la subcolección source_results
+    (índice invertido dominio -> resultado), sus contadores en source_index y
+    su contador en los documentos de source_rankings (top por keyword, modelo,
+    query, día y marca), todo en el mismo batch.
+    """
+    domains = {normalize_domain(url) for url in result_data.get('sources') or []}
+    domains.discard(None)
+    if not domains:
+        return
+
+    firestore = lazy_import('firebase_admin.firestore')
+    db = get_db()
+    entry = source_index_entry(result_data)
+    dimensions = source_dimensions(entry)
+    writes_per_domain = 2 + len(dimensions)
+    batch = db.batch()
+    writes = 0
+
+    for domain in sorted(domains):
+        # Las escrituras de un dominio nunca se reparten entre dos batches
+        if writes + writes_per_domain > SOURCE_BATCH_WRITES:
+            batch.commit()
+            batch = db.batch()
+            writes = 0
+
+        ref = db.collection('source_index').document(domain)
+        counters = {'domain': domain, 'total_count': firestore.Increment(1), 'last_seen': entry['tracked_at'],
+                    'version': firestore.Increment(1)}
+        for dimension, value in dimensions:
+            counters.setdefault(SOURCE_FIELDS[dimension], {})[value] = firestore.Increment(1)
+            batch.set(source_ranking_ref(dimension, value),
+                      {'dimension': dimension, 'value': value, 'counts': {domain: firestore.Increment(1)}},
+                      merge=True)
+        batch.set(ref, counters, merge=True)
+        batch.set(ref.collection(SOURCE_RESULTS).document(entry['result_id']), entry)
+        writes += writes_per_domain
+
+    batch.commit()
+
+def remove_from_source_index(batch, result_data, domains):
+    """Añade al batch la operación inversa de update_source_index para `domains`.
+
+    Devuelve el número de escrituras añadidas.
+    """
+    firestore = lazy_import('firebase_admin.firestore')
+    db = get_db()
+    entry = source_index_entry(result_data)
+    dimensions = source_dimensions(entry)
+    for domain in sorted(domains):
+        ref = db.collection('source_index').document(domain)
+        counters = {'total_count': firestore.Increment(-1), 'version': firestore.Increment(1)}
+        for dimension, value in dimensions:
+            counters.setdefault(SOURCE_FIELDS[dimension], {})[value] = firestore.Increment(-1)
+            batch.set(source_ranking_ref(dimension, value), {'counts': {domain: firestore.Increment(-1)}},
+                      merge=True)
+        batch.set(ref, counters, merge=True)
+        batch.delete(ref.collection(SOURCE_RESULTS).document(entry['result_id']))
+    return len(domains) * (2 + len(dimensions))
+
+SOURCE_PAGE_SIZE = 500       # entradas leídas por página al recalcular un dominio
+SOURCE_BATCH_WRITES = 450    # escrituras por batch (límite de Firestore: 500)
+SOURCE_RECOMPUTE_ATTEMPTS = 5
+
+def count_source_domain(domain):
+    """Cuenta las entradas de un dominio leyendo su índice por páginas"""
+    entries = get_db().collection('source_index').document(domain).collection(SOURCE_RESULTS)
+    new = {'domain': domain, 'total_count': 0, 'last_seen': None}
+    for field in SOURCE_FIELDS.values():
+        new[field] = {}
+
+    last = None
+    while True:
+        query = entries.order_by('__name__').limit(SOURCE_PAGE_SIZE)
+        if last is not None:
+            query = query.start_after(last)
+        docs = list(query.stream())
+        for doc in docs:
+            entry = doc.to_dict()
+            tracked_at = _as_naive(entry['tracked_at'])
+            new['total_count'] += 1
+            if new['last_seen'] is None or tracked_at > new['last_seen']:
+                new['last_seen'] = tracked_at
+            for dimension, value in source_dimensions(entry):
+                counts = new[SOURCE_FIELDS[dimension]]
+                counts[value] = counts.get(value, 0) + 1
+        if len(docs) < SOURCE_PAGE_SIZE:
+            return new
+        last = docs[-1]
+
+def _swap_source_domain_in_transaction(transaction, ref, version, new):
+    """Sustituye los contadores del dominio si nadie lo ha indexado desde que se leyó.
+
+    Devuelve los contadores anteriores, o None si la versión cambió.
+    """
+    snapshot = ref.get(transaction=transaction)
+    old = snapshot.to_dict() if snapshot.exists else {}
+    if old.get('version', 0) != version:
+        return None
+    if new['total_count']:
+        transaction.set(ref, dict(new, version=version + 1))
+    else:
+        transaction.delete(ref)
+    return old
+
+def recompute_source_domain(domain):
+    """Recalcula los contadores de un dominio a partir de sus entradas.
+
+    Las entradas se leen por páginas fuera de la transacción; cada batch de
+    update_source_index incrementa la versión del documento del dominio, así
+    que si alguien lo indexa mientras tanto se vuelve a contar. La transacción
+    solo escribe el documento del dominio; los rankings se corrigen después con
+    incrementos (nuevo - anterior) en batches acotados, que no pisan los
+    incrementos concurrentes.
+    """
+    firestore = lazy_import('firebase_admin.firestore')
+    db = get_db()
+    ref = db.collection('source_index').document(domain)
+
+    for _ in range(SOURCE_RECOMPUTE_ATTEMPTS):
+        snapshot = ref.get()
+        version = (snapshot.to_dict() or {}).get('version', 0) if snapshot.exists else 0
+        new = count_source_domain(domain)
+        old = firestore.transactional(_swap_source_domain_in_transaction)(db.transaction(), ref, version, new)
+        if old is not None:
+            break
+    else:
+        raise RuntimeError(f"No se pudo recalcular {domain}: se sigue indexando")
+
+    batch = db.batch()
+    writes = 0
+    for dimension, field in SOURCE_FIELDS.items():
+        old_counts = old.get(field, {})
+        for value in set(old_counts) | set(new[field]):
+            delta = new[field].get(value, 0) - old_counts.get(value, 0)
+            if not delta:
+                continue
+            batch.set(source_ranking_ref(dimension, value),
+                      {'dimension': dimension, 'value': value, 'counts': {domain: firestore.Increment(delta)}},
+                      merge=True)
+            writes += 1
+            if writes >= SOURCE_BATCH_WRITES:
+                batch.commit()
+                batch = db.batch()
+                writes = 0
+    if writes:
+        batch.commit()
+
+def store_result(result_data):
+    """Guarda un resultado de tracking y actualiza las vistas derivadas"""
+    update_time, doc_ref = get_db().collection('tracking_results').add(result_data)
+    result_data = dict(result_data, result_id=doc_ref.id)
+    try:
+        update_keyword_performance(result_data)
+    except Exception as e:
+        # El resultado ya está guardado; la vista se puede reconstruir
+        print(f"Error actualizando keyword_performance: {e}")
+    try:
+        update_source_index(result_data)
+    except Exception as e:
+        print(f"Error actualizando source_index: {e}")
+    return doc_ref.id
+
+def enqueue_tracking(query_id, query_data, work_items):
+    """Encola los work items de una query para los workers. Devuelve (encolados, omitidos)."""
+    queue = work_queue.connect()
+    try:
+        return queue.enqueue(query_id, work_items, query_data.get('competitors', []))
+    finally:
+        queue.close()
+
+def run_tracking(query_id, query_data, work_items=None):
+    """Ejecuta todos los work items de una query y devuelve los resultados"""
+    if work_items is None:
+        work_items = plan_tracking(query_data)
+    competitors = query_data.get('competitors', [])
+
+    results = []
+    for item in work_items:
+        results.extend(execute_work_item(query_id, item, competitors))
+    return results
+
+
 # Rutas de la API
 
 @app.route('/')
@@ -333,7 +1241,7 @@ def queries_list_page():
 def get_queries():
     """Obtiene todas las queries"""
     try:
-        queries_ref = db.collection('queries').order_by('updated_at', direction=firestore.Query.DESCENDING)
+        queries_ref = get_db().collection('queries').order_by('updated_at', direction=DESCENDING)
         docs = queries_ref.stream()
         
         queries = []
@@ -351,7 +1259,7 @@ def get_queries():
             # Para métricas exactas, tendríamos que consultar la colección tracking_results
             
             # Consultar últimos resultados para métricas
-            results_ref = db.collection('tracking_results').where('query_id', '==', doc.id).limit(100)
+            results_ref = get_db().collection('tracking_results').where('query_id', '==', doc.id).limit(100)
             results_docs = results_ref.stream()
             
             results = []
@@ -406,7 +1314,7 @@ def get_queries():
 @app.route('/api/queries/<query_id>', methods=['GET'])
 def get_query(query_id):
     """Obtiene una query específica"""
-    doc_ref = db.collection('queries').document(query_id)
+    doc_ref = get_db().collection('queries').document(query_id)
     doc = doc_ref.get()
     
     if not doc.exists:
@@ -437,7 +1345,7 @@ def create_query():
         'updated_at': datetime.now()
     }
     
-    update_time, doc_ref = db.collection('queries').add(new_query)
+    update_time, doc_ref = get_db().collection('queries').add(new_query)
     
     return jsonify({'id': doc_ref.id, 'message': 'Query creada correctamente'}), 201
 
@@ -445,7 +1353,7 @@ def create_query():
 def update_query(query_id):
     """Actualiza una query existente"""
     data = request.json
-    doc_ref = db.collection('queries').document(query_id)
+    doc_ref = get_db().collection('queries').document(query_id)
     
     update_data = {
         'name': data.get('name', ''),
@@ -462,119 +1370,65 @@ def update_query(query_id):
 
 @app.route('/api/queries/<query_id>', methods=['DELETE'])
 def delete_query(query_id):
-    """Elimina una query"""
-    db.collection('queries').document(query_id).delete()
-    # Opcional: Eliminar resultados asociados
-    # results = db.collection('tracking_results').where('query_id', '==', query_id).stream()
-    # for r in results:
-    #     r.reference.delete()
-    return jsonify({'message': 'Query eliminada correctamente'})
+    """Elimina una query (sus resultados se borran en segundo plano)"""
+    db = get_db()
+    # La marca en deleted_queries se escribe con el borrado: si el proceso muere
+    # antes de terminar la limpieza, la retención la retoma
+    batch = db.batch()
+    batch.set(db.collection('deleted_queries').document(query_id),
+              {'query_id': query_id, 'deleted_at': datetime.now()})
+    batch.delete(db.collection('queries').document(query_id))
+    batch.commit()
+    job = start_maintenance_job('cascade_delete', cascade_delete_query, query_id)
+    return jsonify({'message': 'Query eliminada correctamente', 'cleanup_job': job['id']})
 
 @app.route('/api/queries/<query_id>/track', methods=['POST'])
 def track_query(query_id):
     """Realiza tracking de una query"""
-    doc_ref = db.collection('queries').document(query_id)
+    doc_ref = get_db().collection('queries').document(query_id)
     doc = doc_ref.get()
     
     if not doc.exists:
         return jsonify({'error': 'Query no encontrada'}), 404
     
     query_data = doc.to_dict()
-    keywords = query_data.get('keywords', [])
-    prompts = query_data.get('prompts', {})
-    model_ids = query_data.get('models', [])
-    
-    results = []
-    
-    # Procesar cada prompt y cada keyword
-    # Cada línea del prompt es una pregunta separada
-    for language, prompt_template in prompts.items():
-        # Dividir el prompt en líneas (cada línea es una pregunta)
-        question_lines = [line.strip() for line in prompt_template.split('\n') if line.strip()]
-        
-        for question_text in question_lines:
-            for keyword in keywords:
-                # Reemplazar placeholder {keyword} en la pregunta
-                prompt = question_text.replace('{keyword}', keyword)
-                
-                # Procesar cada modelo
-                for model_id in model_ids:
-                    try:
-                        # Buscar el modelo en la lista de disponibles
-                        model_info = next((m for m in AVAILABLE_MODELS if m['id'] == model_id), None)
-                        if not model_info:
-                            continue
-                        
-                        # Consultar según el provider
-                        # Consultar según el provider
-                        if model_info['provider'] == 'groq':
-                            # Extraer parámetros específicos del modelo si existen
-                            params = model_info.get('params', {})
-                            response, elapsed, sources = query_groq(model_id, prompt, GROQ_API_KEY, params)
-                        elif model_info['provider'] == 'openai':
-                            params = model_info.get('params', {})
-                            response, elapsed, sources = query_openai(model_id, prompt, OPENAI_API_KEY, params)
-                        elif model_info['provider'] == 'google':
-                            response, elapsed, sources = query_gemini(prompt, GOOGLE_API_KEY)
-                        elif model_info['provider'] == 'openrouter':
-                            # Mapear el modelo de openrouter
-                            openrouter_model = "deepseek/deepseek-chat" if model_id == "deepseek-chat" else model_id
-                            response, elapsed, sources = query_openrouter(openrouter_model, prompt, OPEN_ROUTER_KEY)
-                        elif model_info['provider'] == 'perplexity':
-                            response, elapsed, sources = query_perplexity(model_id, prompt, PERPLEXITY_API_KEY)
-                        else:
-                            continue
-                        
-                        print(f"DEBUG: Consultando modelo {model_id} para keyword '{keyword}'...")
-                        
-                        # Calcular posición y visibilidad
-                        position = find_keyword_position(response, keyword)
-                        visibility = calculate_visibility(response, keyword)
-                        
-                        # Guardar resultado en Firestore
-                        result_data = {
-                            'query_id': query_id,
-                            'keyword': keyword,
-                            'model_id': model_id,
-                            'prompt_text': prompt,
-                            'question_text': question_text,
-                            'language': language,
-                            'response_text': response,
-                            'sources': sources, # Guardar fuentes
-                            'position': position,
-                            'visibility': visibility,
-                            'tracked_at': datetime.now()
-                        }
-                        
-                        db.collection('tracking_results').add(result_data)
-                        
-                        results.append({
-                            'keyword': keyword,
-                            'model': model_id,
-                            'question': question_text,
-                            'position': position,
-                            'visibility': visibility,
-                            'success': True
-                        })
-                        
-                    except Exception as e:
-                        print(f"Error tracking {keyword} on {model_id}: {e}")
-                        results.append({
-                            'keyword': keyword,
-                            'model': model_id,
-                            'question': question_text,
-                            'error': str(e),
-                            'success': False
-                        })
-
-    return jsonify({'results': results, 'message': 'Tracking completado'})
+    work_items = plan_tracking(query_data)
+
+    if TRACKING_MODE == 'queue':
+        enqueued, skipped = enqueue_tracking(query_id, query_data, work_items)
+        return jsonify({
+            'planned_calls': len(work_items),
+            'enqueued': enqueued,
+            'skipped': skipped,
+            'message': 'Tracking encolado'
+        }), 202
+
+    try:
+        run, attached = tracking_admission.submit(query_id, lambda: run_tracking(query_id, query_data, work_items))
+    except AdmissionRejected as e:
+        return too_many_requests(str(e), e.retry_after)
+
+    # Una petición duplicada no ocupa un hilo esperando a la ejecución en curso
+    if attached:
+        return jsonify({'attached': True, 'message': 'Tracking ya en curso para esta query'}), 202
+    if isinstance(run['error'], AdmissionRejected):
+        return too_many_requests(str(run['error']), run['error'].retry_after)
+    if run['error']:
+        return jsonify({'error': str(run['error'])}), 500
+
+    return jsonify({
+        'results': run['result'],
+        'planned_calls': len(work_items),
+        'attached': False,
+        'message': 'Tracking completado'
+    })
 
 @app.route('/api/queries/<query_id>/results', methods=['GET'])
 @app.route('/api/queries/<query_id>/results', methods=['GET'])
 def get_tracking_results(query_id):
     """Obtiene los resultados de tracking de una query"""
     # Nota: Eliminamos order_by para evitar requerir un índice compuesto
-    results_ref = db.collection('tracking_results').where('query_id', '==', query_id).limit(200)
+    results_ref = get_db().collection('tracking_results').where('query_id', '==', query_id).limit(200)
     docs = results_ref.stream()
     
     results = []
@@ -586,16 +1440,255 @@ def get_tracking_results(query_id):
         
     return jsonify(results)
 
+@app.route('/api/queries/<query_id>/performance', methods=['GET'])
+def get_keyword_performance(query_id):
+    """Tabla materializada de rendimiento por (pregunta, keyword, modelo)"""
+    fields = ['question_text', 'language', 'keyword', 'model_id', 'latest_result_id', 'latest_tracked_at',
+              'latest_position', 'latest_visibility', 'latest_sources', 'position_24h_ago',
+              'visibility_24h_ago', 'position_change_24h', 'visibility_change_24h',
+              'avg_position', 'avg_visibility', 'result_count']
+    performance = get_db().collection('keyword_performance').where('query_id', '==', query_id).select(fields)
+    rows = [doc.to_dict() for doc in performance.stream()]
+
+    # Queries con resultados anteriores a la vista: se rellena en el primer acceso
+    if not rows:
+        has_results = list(get_db().collection('tracking_results').where('query_id', '==', query_id)
+                           .select(['query_id']).limit(1).stream())
+        if has_results and build_keyword_performance(query_id):
+            rows = [doc.to_dict() for doc in performance.stream()]
+
+    return jsonify(rows)
+
+def build_keyword_performance(query_id):
+    """Reconstruye las filas de keyword_performance de una query. Devuelve cuántas escribió."""
+    groups = {}
+    fields = ['query_id', 'question_text', 'language', 'keyword', 'model_id',
+              'position', 'visibility', 'sources', 'tracked_at']
+    docs = get_db().collection('tracking_results').where('query_id', '==', query_id).select(fields).stream()
+    for doc in docs:
+        r = doc.to_dict()
+        if not r.get('tracked_at') or r.get('question_text') is None:
+            continue
+        r['result_id'] = doc.id
+        key = performance_doc_id(query_id, r['question_text'], r.get('keyword'), r.get('model_id'))
+        groups.setdefault(key, []).append(r)
+
+    batch = get_db().batch()
+    pending = 0
+    for doc_id, group in groups.items():
+        group.sort(key=lambda r: _as_naive(r['tracked_at']))
+        history = [_history_point(r) for r in group[-KP_HISTORY_SIZE:]]
+        row = build_performance_row(group[-1], history, len(group))
+        batch.set(get_db().collection('keyword_performance').document(doc_id), row)
+        pending += 1
+        if pending == 400:
+            batch.commit()
+            batch = get_db().batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    return len(groups)
+
+@app.route('/api/queries/<query_id>/performance/rebuild', methods=['POST'])
+def rebuild_keyword_performance(query_id):
+    """Reconstruye la vista materializada de una query a partir de tracking_results"""
+    rows = build_keyword_performance(query_id)
+    return jsonify({'rows': rows, 'message': 'Vista reconstruida'})
+
+def source_ranking_counts(dimension, value):
+    """Contadores por dominio de un documento de source_rankings"""
+    doc = source_ranking_ref(dimension, value).get()
+    return (doc.to_dict() or {}).get('counts', {}) if doc.exists else {}
+
+@app.route('/api/sources/top', methods=['GET'])
+def get_top_sources():
+    """Dominios más citados (opcionalmente por keyword, modelo, query o últimos N días)"""
+    limit = request.args.get('limit', 20, type=int)
+    days = request.args.get('days', type=int)
+    filters = {'keyword': request.args.get('keyword'), 'model': request.args.get('model_id'),
+               'query': request.args.get('query_id')}
+    active = [k for k, v in filters.items() if v] + (['days'] if days else [])
+    if len(active) > 1:
+        return jsonify({'error': 'Solo se admite un filtro a la vez (keyword, model_id, query_id o days)'}), 400
+
+    if not active:
+        docs = get_db().collection('source_index').order_by('total_count', direction=DESCENDING).limit(limit).stream()
+        return jsonify([
+            {'domain': d.get('domain'), 'count': d.get('total_count', 0)}
+            for d in (doc.to_dict() for doc in docs) if d.get('total_count', 0) > 0
+        ])
+
+    if days:
+        # Un documento de ranking por día (máximo un año)
+        today = datetime.now()
+        refs = [source_ranking_ref('day', (today - timedelta(days=i)).strftime('%Y-%m-%d'))
+                for i in range(min(days, 366))]
+        counts = {}
+        for doc in get_db().get_all(refs):
+            if doc.exists:
+                for domain, n in (doc.to_dict() or {}).get('counts', {}).items():
+                    counts[domain] = counts.get(domain, 0) + n
+    else:
+        dimension = active[0]
+        counts = source_ranking_counts(dimension, filters[dimension])
+
+    ranking = [{'domain': domain, 'count': n} for domain, n in counts.items() if n > 0]
+    ranking.sort(key=lambda x: x['count'], reverse=True)
+    return jsonify(ranking[:limit])
+
+@app.route('/api/sources/brand', methods=['GET'])
+def get_brand_sources():
+    """Fuentes citadas en respuestas que mencionan una keyword/marca"""
+    keyword = request.args.get('keyword')
+    if not keyword:
+        return jsonify({'error': 'Parámetro keyword obligatorio'}), 400
+    limit = request.args.get('limit', 20, type=int)
+
+    mentions = source_ranking_counts('brand', keyword)
+    citations = source_ranking_counts('keyword', keyword)
+    sources = [
+        {
+            'domain': domain,
+            'mentions': n,
+            'citations': citations.get(domain, 0),
+            'mention_rate': round(n * 100 / citations[domain], 1) if citations.get(domain) else None
+        }
+        for domain, n in mentions.items() if n > 0
+    ]
+    sources.sort(key=lambda x: x['mentions'], reverse=True)
+    return jsonify(sources[:limit])
+
+@app.route('/api/sources/<domain>/results', methods=['GET'])
+def get_source_results(domain):
+    """Resultados que citan un dominio (entradas del índice invertido)"""
+    limit = request.args.get('limit', 50, type=int)
+    domain = normalize_domain(domain) or domain
+    docs = get_db().collection('source_index').document(domain).collection(SOURCE_RESULTS)\
+        .order_by('tracked_at', direction=DESCENDING).limit(limit).stream()
+    return jsonify([doc.to_dict() for doc in docs])
+
+@app.route('/api/sources/rebuild', methods=['POST'])
+def trigger_source_rebuild():
+    """Lanza la reconstrucción del índice de fuentes en segundo plano"""
+    job = start_maintenance_job('source_rebuild', rebuild_source_index)
+    return jsonify({'job_id': job['id'], 'message': 'Reconstrucción del índice de fuentes iniciada'}), 202
+
+def rebuild_source_index(job=None):
+    """Reconstruye el índice de fuentes a partir de tracking_results.
+
+    Primero escribe las entradas de todos los resultados (idempotente), después
+    borra las entradas de resultados que ya no existen y recalcula cada dominio
+    con recompute_source_domain. Las entradas posteriores al inicio no se tocan.
+    """
+    db = get_db()
+    started_at = datetime.now()
+    valid = {}  # dominio -> ids de resultados que lo citan
+    batch = db.batch()
+    writes = 0
+
+    fields = ['query_id', 'keyword', 'model_id', 'visibility', 'sources', 'tracked_at']
+    for page in iter_result_pages(fields=fields):
+        for r in page:
+            domains = {normalize_domain(url) for url in r.get('sources') or []}
+            domains.discard(None)
+            if not domains or not isinstance(r.get('tracked_at'), datetime):
+                continue
+            entry = source_index_entry(dict(r, result_id=r['id']))
+            for domain in domains:
+                valid.setdefault(domain, set()).add(r['id'])
+                ref = db.collection('source_index').document(domain).collection(SOURCE_RESULTS).document(r['id'])
+                batch.set(ref, entry)
+                writes += 1
+                if writes >= SOURCE_BATCH_WRITES:
+                    batch.commit()
+                    batch = db.batch()
+                    writes = 0
+    if writes:
+        batch.commit()
+
+    existing = {doc.id for doc in db.collection('source_index').select(['domain']).stream()}
+    for domain in existing | set(valid):
+        stale = [
+            doc.reference
+            for doc in db.collection('source_index').document(domain).collection(SOURCE_RESULTS)
+            .select(['tracked_at']).stream()
+            if doc.id not in valid.get(domain, set()) and _as_naive(doc.get('tracked_at')) < started_at
+        ]
+        for i in range(0, len(stale), SOURCE_BATCH_WRITES):
+            batch = db.batch()
+            for ref in stale[i:i + SOURCE_BATCH_WRITES]:
+                batch.delete(ref)
+            batch.commit()
+        recompute_source_domain(domain)
+        if job is not None:
+            job['processed'] += 1
+
+    print(f"Índice de fuentes reconstruido: {len(valid)} dominios")
+    return len(valid)
+
+@app.route('/api/results/<result_id>', methods=['GET'])
+def get_result(result_id):
+    """Obtiene un resultado de tracking completo (respuesta y fuentes)"""
+    doc = get_db().collection('tracking_results').document(result_id).get()
+    if not doc.exists:
+        return jsonify({'error': 'Resultado no encontrado'}), 404
+    result = doc.to_dict()
+    result['id'] = doc.id
+    return jsonify(result)
+
+@app.route('/api/queue/stats', methods=['GET'])
+def get_queue_stats():
+    """Estado de la cola de trabajo compartida (opcionalmente de una query)"""
+    # Fuera del modo queue no hay cola que consultar (y en Vercel no se puede crear)
+    if TRACKING_MODE != 'queue':
+        return jsonify({'mode': TRACKING_MODE, 'backend': None, 'items': None})
+    try:
+        queue = work_queue.connect()
+        try:
+            counts = queue.stats(request.args.get('query_id'))
+        finally:
+            queue.close()
+    except Exception as e:
+        return jsonify({'error': f'Cola de trabajo no disponible: {e}'}), 503
+    return jsonify({'mode': TRACKING_MODE, 'backend': work_queue.QUEUE_BACKEND, 'items': counts})
+
 @app.route('/api/models', methods=['GET'])
 def get_models():
     """Obtiene la lista de modelos disponibles"""
     return jsonify(AVAILABLE_MODELS)
 
+@app.route('/api/providers/health', methods=['GET'])
+def get_providers_health():
+    """Estado del circuit breaker y latencias recientes de cada provider"""
+    providers = []
+    for provider in sorted({m['provider'] for m in AVAILABLE_MODELS}):
+        health = get_breaker(provider).snapshot()
+        health['models'] = [
+            {
+                'id': m['id'],
+                'hedge_delay': round(get_hedge_delay(m['id']), 3),
+                'deadline': m.get('deadline', MODEL_DEADLINE)
+            }
+            for m in AVAILABLE_MODELS if m['provider'] == provider
+        ]
+        providers.append(health)
+    return jsonify(providers)
+
+@app.route('/api/startup', methods=['GET'])
+def get_startup_report():
+    """Coste de arranque de este proceso: import de app.py y cargas perezosas"""
+    lazy_modules = ['firebase_admin', 'groq', 'openai', 'google.generativeai']
+    return jsonify({
+        'app_import_seconds': _startup_seconds,
+        'lazy_timings': _lazy_timings,
+        'not_loaded': [m for m in lazy_modules if m not in sys.modules]
+    })
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Obtiene estadísticas globales del dashboard"""
     # Resultados totales
-    results_coll = db.collection('tracking_results')
+    results_coll = get_db().collection('tracking_results')
     
     # Esta consulta puede ser costosa, idealmente usar contadores distribuidos o stats cacheadas
     # Para este MVP, limitamos la consulta reciente para estadisticas "vivas"
@@ -605,12 +1698,12 @@ def get_stats():
     total_results = total_results_agg[0][0].value
     
     # Queries activas
-    queries_coll = db.collection('queries')
+    queries_coll = get_db().collection('queries')
     active_queries_agg = queries_coll.count().get()
     active_queries = active_queries_agg[0][0].value
     
     # Para resto de métricas, analizamos los últimos N resultados
-    recent_results = results_coll.order_by('tracked_at', direction=firestore.Query.DESCENDING).limit(500).stream()
+    recent_results = results_coll.order_by('tracked_at', direction=DESCENDING).limit(500).stream()
     
     vis_sum = 0
     vis_count = 0
@@ -648,14 +1741,27 @@ def get_chart_data():
     # Nota: Firestore requiere índice compuesto para rango + orden. 
     # Si falla, simplificaremos a traer últimos N y filtrar en código.
     try:
-        results_ref = db.collection('tracking_results')\
-            .order_by('tracked_at', direction=firestore.Query.ASCENDING)\
+        results_ref = get_db().collection('tracking_results')\
+            .order_by('tracked_at', direction=ASCENDING)\
             .limit(1000) 
         
         docs = results_ref.stream()
         
-        data_by_date = {} # date -> { brand: [visibilities] }
+        data_by_date = {} # date -> { brand: [suma de visibilidad, resultados] }
         all_brands = set()
+
+        # Días cuyos resultados ya se sumaron a daily_aggregates por la retención
+        aggregates = get_db().collection('daily_aggregates')\
+            .order_by('date', direction=ASCENDING)\
+            .limit(1000)\
+            .select(['date', 'keyword', 'visibility_sum', 'results'])
+        for doc in aggregates.stream():
+            a = doc.to_dict()
+            brand = a.get('keyword')
+            all_brands.add(brand)
+            totals = data_by_date.setdefault(a['date'], {}).setdefault(brand, [0, 0])
+            totals[0] += a.get('visibility_sum', 0)
+            totals[1] += a.get('results', 0)
         
         for doc in docs:
             r = doc.to_dict()
@@ -674,7 +1780,7 @@ def get_chart_data():
                     continue
             
             brand = r.get('keyword') # Asumimos keyword = brand
-            vis = r.get('visibility', 0)
+            vis = r.get('visibility') or 0
             
             all_brands.add(brand)
             
@@ -682,9 +1788,10 @@ def get_chart_data():
                 data_by_date[date_str] = {}
             
             if brand not in data_by_date[date_str]:
-                data_by_date[date_str][brand] = []
+                data_by_date[date_str][brand] = [0, 0]
                 
-            data_by_date[date_str][brand].append(vis)
+            data_by_date[date_str][brand][0] += vis
+            data_by_date[date_str][brand][1] += 1
             
         # Preparar estructura para Chart.js
         sorted_dates = sorted(data_by_date.keys())
@@ -696,8 +1803,8 @@ def get_chart_data():
         for i, brand in enumerate(all_brands):
             data_points = []
             for date in sorted_dates:
-                vals = data_by_date[date].get(brand, [])
-                avg = sum(vals)/len(vals) if vals else 0
+                vis_sum, count = data_by_date[date].get(brand, (0, 0))
+                avg = vis_sum / count if count else 0
                 data_points.append(round(avg, 1))
             
             datasets.append({
@@ -723,24 +1830,37 @@ def get_ranking():
     """Ranking de marcas/keywords"""
     # Basado en visibilidad promedio reciente
     try:
-        results_ref = db.collection('tracking_results')\
-            .order_by('tracked_at', direction=firestore.Query.DESCENDING)\
+        results_ref = get_db().collection('tracking_results')\
+            .order_by('tracked_at', direction=DESCENDING)\
             .limit(500)
             
         docs = results_ref.stream()
         
         brand_stats = {}
+        read = 0
         
         for doc in docs:
             r = doc.to_dict()
             brand = r.get('keyword')
-            vis = r.get('visibility', 0)
+            vis = r.get('visibility') or 0
+            read += 1
             
             if brand not in brand_stats:
                 brand_stats[brand] = {'total_vis': 0, 'count': 0}
             
             brand_stats[brand]['total_vis'] += vis
             brand_stats[brand]['count'] += 1
+
+        # Si hay menos de 500 resultados crudos, la muestra incluye también los
+        # más antiguos, que la retención ya sumó en daily_aggregates
+        if read < 500:
+            aggregates = get_db().collection('daily_aggregates')\
+                .select(['keyword', 'visibility_sum', 'results']).stream()
+            for doc in aggregates:
+                a = doc.to_dict()
+                stats = brand_stats.setdefault(a.get('keyword'), {'total_vis': 0, 'count': 0})
+                stats['total_vis'] += a.get('visibility_sum', 0)
+                stats['count'] += a.get('results', 0)
             
         ranking = []
         for brand, stats in brand_stats.items():
@@ -769,7 +1889,7 @@ def get_top_prompts():
     try:
         # En un caso real, esto requeriría métricas por prompt
         # Aquí devolveremos los prompts de las queries activas
-        queries_ref = db.collection('queries').stream()
+        queries_ref = get_db().collection('queries').stream()
         
         prompts_list = []
         for q_doc in queries_ref:
@@ -796,46 +1916,611 @@ def get_top_prompts():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def run_track_all(query_ids):
+    """Trackea las queries una a una pasando por el control de admisión (o las encola en modo queue)"""
+    try:
+        for query_id in query_ids:
+            doc = get_db().collection('queries').document(query_id).get()
+            if not doc.exists:
+                continue
+            query_data = doc.to_dict()
+            if TRACKING_MODE == 'queue':
+                enqueue_tracking(query_id, query_data, plan_tracking(query_data))
+                continue
+            while True:
+                try:
+                    tracking_admission.submit(query_id, lambda: run_tracking(query_id, query_data))
+                    break
+                except AdmissionRejected as e:
+                    time.sleep(e.retry_after)
+    except Exception as e:
+        print(f"Error en track-all: {e}")
+    finally:
+        _track_all_lock.release()
+
 @app.route('/api/track-all', methods=['POST'])
 def track_all():
-    """Ejecuta el tracking para TODAS las queries"""
+    """Ejecuta el tracking para TODAS las queries en segundo plano"""
+    if not _track_all_lock.acquire(blocking=False):
+        return jsonify({'attached': True, 'message': 'Ya hay un tracking de todas las queries en curso'}), 202
     try:
-        queries_ref = db.collection('queries').stream()
-        
-        count = 0
-        for q_doc in queries_ref:
-            # Llamamos a la función track_query existent internamente 
-            # NOTA: Esto bloqueará el request. En prod usar background task (Celery/RQ).
-            # Para este MVP, lo hacemos síncrono pero con riesgo de timeout.
-            # Alternativa: Lanzar threads.
-            
-            # Reutilizamos la lógica de track_query pero sin retorno HTTP por cada una
-            query_id = q_doc.id
-            # track_query(query_id) -> esto retornaría un Response object, no queremos eso.
-            # Lo ideal es refactorizar la lógica de track_query a una funcion auxiliar
-            # Por ahora, haremos una llamada simulada rápida o hack para invocar la ruta
-            
-            # Mejor opción rápida: requests a localhost (loopback) para no bloquear este hilo demasiado
-            # o simplemente iterar. Iterar es peligroso por timeout.
-            
-            # Vamos a refactorizar track_query ligeramente en memoria invocando la lógica.
-            # Pero dado el tiempo, haremos un hack: requests.post a sí mismo
+        query_ids = [q_doc.id for q_doc in get_db().collection('queries').stream()]
+    except Exception as e:
+        _track_all_lock.release()
+        return jsonify({'error': str(e)}), 500
+
+    threading.Thread(target=run_track_all, args=(query_ids,), daemon=True).start()
+    return jsonify({'message': f'Tracking iniciado para {len(query_ids)} queries'}), 202
+
+@app.route('/api/tracking/admission', methods=['GET'])
+def get_tracking_admission():
+    """Ejecuciones de tracking en curso y en espera"""
+    return jsonify(tracking_admission.snapshot())
+
+# Exportación y analítica de tracking_results. pandas/pyarrow/openpyxl se cargan
+# con lazy_import y los datos se leen de Firestore por páginas.
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+EXPORT_COLUMNS = ['id', 'query_id', 'keyword', 'model_id', 'served_by', 'language', 'question_text',
+                  'prompt_text', 'response_text', 'sources', 'position', 'visibility', 'elapsed', 'tracked_at']
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.file', 'arrow'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx')
+}
+ANALYTICS_GROUP_BY = ['keyword', 'model_id', 'query_id', 'language', 'date']
+
+def parse_results_filters(args):
+    """Lee los filtros comunes (query_id, model_id, from, to) de la query string"""
+    filters = {'query_id': args.get('query_id'), 'model_id': args.get('model_id'),
+               'date_from': None, 'date_to': None}
+    for arg, key in (('from', 'date_from'), ('to', 'date_to')):
+        if args.get(arg):
             try:
-                requests.post(f"http://127.0.0.1:5000/api/queries/{query_id}/track", timeout=1)
-            except requests.exceptions.ReadTimeout:
-                pass # Ignoramos timeout, asumimos que sigue procesando
-            except Exception as e:
-                print(f"Error triggering track for {query_id}: {e}")
-                
-            count += 1
-            
-        return jsonify({'message': f'Tracking iniciado para {count} queries'})
+                # Fechas con zona (p. ej. ...Z) se pasan a UTC sin zona como tracked_at
+                filters[key] = _as_naive(datetime.fromisoformat(args[arg].replace('Z', '+00:00')))
+            except ValueError:
+                raise ValueError(f"Fecha no válida en '{arg}': {args[arg]}")
+    return filters
+
+def iter_result_pages(query_id=None, model_id=None, date_from=None, date_to=None, fields=None,
+                      page_size=EXPORT_PAGE_SIZE):
+    """Recorre tracking_results por páginas (listas de dicts con 'id').
+
+    Los filtros de igualdad van a Firestore. El rango de fechas solo se envía a
+    Firestore si no hay filtros de igualdad, para no requerir un índice compuesto.
+    """
+    base = get_db().collection('tracking_results')
+    if query_id:
+        base = base.where('query_id', '==', query_id)
+    if model_id:
+        base = base.where('model_id', '==', model_id)
+
+    filter_dates_in_code = bool(query_id or model_id)
+    if filter_dates_in_code:
+        base = base.order_by('__name__')
+    else:
+        if date_from:
+            base = base.where('tracked_at', '>=', date_from)
+        if date_to:
+            base = base.where('tracked_at', '<', date_to)
+        base = base.order_by('tracked_at', direction=ASCENDING)
+    if fields:
+        base = base.select(list(set(fields) | {'tracked_at'}))
+
+    last_doc = None
+    while True:
+        page_query = base.limit(page_size)
+        if last_doc is not None:
+            page_query = page_query.start_after(last_doc)
+        docs = list(page_query.stream())
+        if not docs:
+            return
+        last_doc = docs[-1]
+
+        page = []
+        for doc in docs:
+            r = doc.to_dict()
+            r['id'] = doc.id
+            r['tracked_at'] = _as_naive(r.get('tracked_at'))
+            if filter_dates_in_code and (date_from or date_to):
+                tracked_at = r['tracked_at']
+                if not isinstance(tracked_at, datetime):
+                    continue
+                if date_from and tracked_at < date_from:
+                    continue
+                if date_to and tracked_at >= date_to:
+                    continue
+            page.append(r)
+        if page:
+            yield page
+        if len(docs) < page_size:
+            return
+
+def results_page_to_frame(page, columns):
+    """Convierte una página de resultados en un DataFrame con tipos fijos"""
+    pd = lazy_import('pandas')
+    df = pd.DataFrame(page).reindex(columns=columns)
+    if 'sources' in df:
+        df['sources'] = df['sources'].map(lambda v: json.dumps(v) if isinstance(v, list) else None)
+    for col in ('position', 'visibility', 'elapsed'):
+        if col in df:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    if 'tracked_at' in df:
+        df['tracked_at'] = pd.to_datetime(df['tracked_at'], errors='coerce')
+    for col in df.columns:
+        if col not in ('position', 'visibility', 'elapsed', 'tracked_at'):
+            df[col] = df[col].astype('object').where(df[col].notna(), None)
+    return df
+
+def _export_arrow_schema(columns):
+    pa = lazy_import('pyarrow')
+    types = {'position': pa.float64(), 'visibility': pa.float64(), 'elapsed': pa.float64(),
+             'tracked_at': pa.timestamp('us')}
+    return pa.schema([(col, types.get(col, pa.string())) for col in columns])
+
+def _stream_file(fh, block_size=1024 * 1024):
+    """Envía un fichero temporal por bloques y lo cierra al terminar"""
+    try:
+        fh.seek(0)
+        while True:
+            block = fh.read(block_size)
+            if not block:
+                break
+            yield block
+    finally:
+        fh.close()
+
+def write_export(fmt, pages, columns):
+    """Escribe las páginas en el formato pedido. Devuelve un generador de bytes."""
+    if fmt == 'csv':
+        def generate():
+            header = True
+            for page in pages:
+                yield results_page_to_frame(page, columns).to_csv(index=False, header=header, date_format='%Y-%m-%dT%H:%M:%S')
+                header = False
+            if header:
+                yield ','.join(columns) + '\n'
+        return generate()
+
+    # Los formatos binarios se escriben por chunks a un fichero temporal
+    fh = tempfile.TemporaryFile()
+    if fmt in ('parquet', 'arrow'):
+        pa = lazy_import('pyarrow')
+        schema = _export_arrow_schema(columns)
+        if fmt == 'parquet':
+            writer = lazy_import('pyarrow.parquet').ParquetWriter(fh, schema)
+        else:
+            writer = lazy_import('pyarrow.ipc').new_file(fh, schema)
+        for page in pages:
+            table = pa.Table.from_pandas(results_page_to_frame(page, columns), schema=schema, preserve_index=False)
+            writer.write_table(table)
+        writer.close()
+    elif fmt == 'xlsx':
+        openpyxl = lazy_import('openpyxl')
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet('tracking_results')
+        sheet.append(columns)
+        pd = lazy_import('pandas')
+        for page in pages:
+            df = results_page_to_frame(page, columns)
+            for row in df.itertuples(index=False):
+                sheet.append([None if pd.isna(v) else
+                              (v.to_pydatetime() if hasattr(v, 'to_pydatetime') else v) for v in row])
+        workbook.save(fh)
+    return _stream_file(fh)
+
+@app.route('/api/export/results', methods=['GET'])
+def export_results():
+    """Exportación masiva de tracking_results (csv, parquet, arrow o xlsx)"""
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"Formato no soportado: {fmt}"}), 400
+    try:
+        filters = parse_results_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    columns = EXPORT_COLUMNS
+    if request.args.get('include_response', 'true').lower() == 'false':
+        columns = [c for c in EXPORT_COLUMNS if c not in ('response_text', 'prompt_text')]
+    fields = [c for c in columns if c != 'id']
+
+    try:
+        body = write_export(fmt, iter_result_pages(fields=fields, **filters), columns)
     except Exception as e:
+        print(f"Error export: {e}")
         return jsonify({'error': str(e)}), 500
 
-# Inicializar y migrar base de datos al arrancar
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f"tracking_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return Response(body, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+def position_bucket(position):
+    """Agrupa posiciones (párrafo) en rangos para la distribución"""
+    pd = lazy_import('pandas')
+    return pd.cut(position, bins=[0, 1, 2, 3, 5, 10, float('inf')],
+                  labels=['1', '2', '3', '4-5', '6-10', '>10']).astype('object').fillna('sin mención')
+
+@app.route('/api/analytics/summary', methods=['GET'])
+def get_analytics_summary():
+    """Resúmenes agrupados (share of voice, distribución de posiciones) sobre los resultados conservados"""
+    pd = lazy_import('pandas')
+    group_by = [g.strip() for g in request.args.get('group_by', 'keyword').split(',') if g.strip()]
+    invalid = [g for g in group_by if g not in ANALYTICS_GROUP_BY]
+    if invalid or not group_by:
+        return jsonify({'error': f"group_by no válido; opciones: {', '.join(ANALYTICS_GROUP_BY)}"}), 400
+    try:
+        filters = parse_results_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        columns = ['query_id', 'keyword', 'model_id', 'language', 'position', 'visibility', 'tracked_at']
+        frames = [results_page_to_frame(page, columns)
+                  for page in iter_result_pages(fields=columns, **filters)]
+        if not frames:
+            return jsonify({'group_by': group_by, 'total_results': 0, 'groups': []})
+        df = pd.concat(frames, ignore_index=True)
+        df['date'] = df['tracked_at'].dt.strftime('%Y-%m-%d')
+        df[group_by] = df[group_by].fillna('desconocido')
+        df['visibility'] = df['visibility'].fillna(0)
+        df['mentioned'] = df['visibility'] > 0
+        df['bucket'] = position_bucket(df['position'])
+
+        grouped = df.groupby(group_by)
+        summary = grouped.agg(
+            results=('visibility', 'size'),
+            mentions=('mentioned', 'sum'),
+            avg_visibility=('visibility', 'mean'),
+            avg_position=('position', 'mean'),
+            visibility_sum=('visibility', 'sum')
+        ).reset_index()
+
+        # Share of voice: parte de la visibilidad total entre las keywords que
+        # comparten el resto de dimensiones del grupo. Solo tiene sentido si se
+        # agrupa por keyword (si no, cada grupo sería el 100% de sí mismo)
+        context = [g for g in group_by if g != 'keyword']
+        with_share = 'keyword' in group_by
+        if with_share:
+            if context:
+                totals = summary.groupby(context)['visibility_sum'].transform('sum')
+            else:
+                totals = pd.Series(summary['visibility_sum'].sum(), index=summary.index)
+            summary['share_of_voice'] = (summary['visibility_sum'] / totals.where(totals > 0) * 100).fillna(0.0)
+        summary['mention_rate'] = summary['mentions'] / summary['results'] * 100
+
+        distribution = df.groupby(group_by + ['bucket']).size().unstack('bucket', fill_value=0)
+        distribution_records = {
+            (key if isinstance(key, tuple) else (key,)): {str(k): int(v) for k, v in row.items()}
+            for key, row in distribution.iterrows()
+        }
+
+        groups = []
+        for record in summary.to_dict('records'):
+            key = tuple(record[g] for g in group_by)
+            groups.append({
+                **{g: record[g] for g in group_by},
+                'results': int(record['results']),
+                'mentions': int(record['mentions']),
+                'mention_rate': round(float(record['mention_rate']), 1),
+                'avg_visibility': round(float(record['avg_visibility']), 2),
+                'avg_position': None if pd.isna(record['avg_position']) else round(float(record['avg_position']), 2),
+                'share_of_voice': round(float(record['share_of_voice']), 1) if with_share else None,
+                'position_distribution': distribution_records.get(key, {})
+            })
+        # Con share of voice: las keywords de cada contexto juntas y de mayor a menor
+        # cuota; por fecha, en orden cronológico; si no, por visibilidad media
+        if with_share:
+            groups.sort(key=lambda g: -g['share_of_voice'])
+            groups.sort(key=lambda g: tuple(str(g[c]) for c in context))
+        elif 'date' in group_by:
+            groups.sort(key=lambda g: tuple(str(g[c]) for c in group_by))
+        else:
+            groups.sort(key=lambda g: g['avg_visibility'], reverse=True)
+
+        return jsonify({'group_by': group_by, 'total_results': int(len(df)), 'groups': groups})
+    except Exception as e:
+        print(f"Error analytics: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+def start_maintenance_job(kind, target, *args):
+    """Lanza una tarea de mantenimiento en un hilo y devuelve su estado"""
+    job = {
+        'id': uuid.uuid4().hex,
+        'kind': kind,
+        'status': 'running',
+        'processed': 0,
+        'error': None,
+        'started_at': datetime.now().isoformat(),
+        'finished_at': None
+    }
+    with _maintenance_lock:
+        _maintenance_jobs[job['id']] = job
 
+    def run():
+        try:
+            target(*args, job=job)
+            job['status'] = 'done'
+        except Exception as e:
+            print(f"Error en tarea {kind}: {e}")
+            job['status'] = 'error'
+            job['error'] = str(e)
+        job['finished_at'] = datetime.now().isoformat()
+
+    threading.Thread(target=run, daemon=True).start()
+    return job
+
+def delete_in_batches(query, job=None, page_size=400):
+    """Borra por páginas todos los documentos de una consulta. Devuelve cuántos borró."""
+    deleted = 0
+    while True:
+        docs = list(query.limit(page_size).stream())
+        if not docs:
+            return deleted
+        batch = get_db().batch()
+        for doc in docs:
+            batch.delete(doc.reference)
+        batch.commit()
+        deleted += len(docs)
+        if job is not None:
+            job['processed'] += len(docs)
+
+def cascade_delete_query(query_id, job=None):
+    """Borra los resultados, vistas e índices de una query eliminada.
+
+    Es idempotente; al terminar borra la marca de deleted_queries.
+    """
+    firestore = lazy_import('firebase_admin.firestore')
+    db = get_db()
+    for collection in ('tracking_results', 'keyword_performance', 'tracking_results_archive'):
+        delete_in_batches(db.collection(collection).where('query_id', '==', query_id), job)
+
+    # Índice de fuentes: se borran las entradas de la query en cada dominio que la
+    # cita y se recalculan sus contadores y rankings
+    by_query = firestore.FieldPath('by_query', query_id).to_api_repr()
+    for domain_doc in db.collection('source_index').where(by_query, '>', 0).select(['domain']).stream():
+        entries = domain_doc.reference.collection(SOURCE_RESULTS).where('query_id', '==', query_id)
+        delete_in_batches(entries, job)
+        recompute_source_domain(domain_doc.id)
+
+    # La cola solo existe en modo queue
+    if TRACKING_MODE == 'queue':
+        try:
+            queue = work_queue.connect()
+            try:
+                queue.cancel_query(query_id)
+            finally:
+                queue.close()
+        except Exception as e:
+            print(f"Error descartando work items de {query_id}: {e}")
+
+    db.collection('deleted_queries').document(query_id).delete()
+
+def resume_deleted_queries(job=None):
+    """Termina la limpieza de las queries eliminadas que quedaron a medias"""
+    resumed = 0
+    for doc in get_db().collection('deleted_queries').stream():
+        cascade_delete_query(doc.id, job=job)
+        resumed += 1
+    return resumed
+
+def compact_old_results(raw_days=RETENTION_RAW_DAYS, mode=RETENTION_MODE, job=None):
+    """Quita el texto de las respuestas con más de raw_days días.
+
+    El resultado puntuado (keyword, modelo, posición, visibilidad, fuentes) se
+    conserva hasta que aggregate_expired_results lo pasa a daily_aggregates.
+    En modo "archive" el texto se
+    copia antes a tracking_results_archive. El progreso se guarda en
+    maintenance/retention para no volver a recorrer lo ya compactado.
+    """
+    if raw_days <= 0:
+        return 0
+    firestore = lazy_import('firebase_admin.firestore')
+    db = get_db()
+    cutoff = datetime.now() - timedelta(days=raw_days)
+    state_ref = db.collection('maintenance').document('retention')
+    state = state_ref.get()
+    since = (state.to_dict() or {}).get('compacted_until') if state.exists else None
+
+    old_results = db.collection('tracking_results').where('tracked_at', '<', cutoff)
+    if since:
+        old_results = old_results.where('tracked_at', '>=', since)
+    old_results = old_results.order_by('tracked_at', direction=ASCENDING)
+    if mode != 'archive':
+        old_results = old_results.select(['tracked_at', 'body_removed'])
+
+    compacted = 0
+    last_doc = None
+    while True:
+        page_query = old_results.limit(RETENTION_PAGE_SIZE)
+        if last_doc is not None:
+            page_query = page_query.start_after(last_doc)
+        docs = list(page_query.stream())
+        if not docs:
+            break
+        last_doc = docs[-1]
+
+        batch = db.batch()
+        pending = 0
+        for doc in docs:
+            r = doc.to_dict()
+            if r.get('body_removed'):
+                continue
+            if mode == 'archive':
+                batch.set(db.collection('tracking_results_archive').document(doc.id), {
+                    'query_id': r.get('query_id'),
+                    'prompt_text': r.get('prompt_text'),
+                    'response_text': r.get('response_text'),
+                    'tracked_at': r.get('tracked_at')
+                })
+            batch.update(doc.reference, {
+                'response_text': firestore.DELETE_FIELD,
+                'prompt_text': firestore.DELETE_FIELD,
+                'body_removed': True
+            })
+            pending += 1
+        if pending:
+            batch.commit()
+
+        state_ref.set({'compacted_until': last_doc.get('tracked_at')}, merge=True)
+        compacted += pending
+        if job is not None:
+            job['processed'] += pending
+
+    state_ref.set({'compacted_until': cutoff}, merge=True)
+    return compacted
+
+def daily_aggregate_ref(date, query_id, keyword, model_id):
+    """Documento de daily_aggregates de un día, query, keyword y modelo"""
+    key = json.dumps([date, query_id, keyword, model_id])
+    return get_db().collection('daily_aggregates').document(hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+def aggregate_expired_results(row_days=RETENTION_ROW_DAYS, job=None):
+    """Suma a daily_aggregates los resultados con más de row_days días y los borra.
+
+    Cada resultado se borra en el mismo batch que suma su agregado y lo quita
+    del índice de fuentes, así que un fallo a medias no cuenta nada dos veces.
+    """
+    if row_days <= 0:
+        return 0
+    firestore = lazy_import('firebase_admin.firestore')
+    db = get_db()
+    cutoff = datetime.now() - timedelta(days=row_days)
+    expired = db.collection('tracking_results').where('tracked_at', '<', cutoff)\
+        .order_by('tracked_at', direction=ASCENDING)\
+        .select(['query_id', 'keyword', 'model_id', 'position', 'visibility', 'sources', 'tracked_at'])
+
+    dropped = 0
+    while True:
+        # Las filas se borran, así que cada página vuelve a empezar por el principio
+        docs = list(expired.limit(RETENTION_PAGE_SIZE).stream())
+        if not docs:
+            break
+        rows = [dict(doc.to_dict(), result_id=doc.id) for doc in docs]
+
+        # Solo se descuentan del índice de fuentes las entradas que existen
+        entries = {(normalize_domain(url), r['result_id']) for r in rows for url in r.get('sources') or []}
+        entry_refs = [db.collection('source_index').document(domain).collection(SOURCE_RESULTS).document(result_id)
+                      for domain, result_id in entries if domain]
+        indexed = {}  # result_id -> dominios con entrada
+        if entry_refs:
+            for snapshot in db.get_all(entry_refs):
+                if snapshot.exists:
+                    indexed.setdefault(snapshot.id, set()).add(snapshot.reference.parent.parent.id)
+
+        batch = db.batch()
+        aggregates = {}
+        writes = 0
+
+        def flush():
+            # Un único incremento por agregado y batch
+            for (date, query_id, keyword, model_id), counts in aggregates.items():
+                fields = {'date': date, 'query_id': query_id, 'keyword': keyword, 'model_id': model_id}
+                fields.update({k: firestore.Increment(v) for k, v in counts.items()})
+                batch.set(daily_aggregate_ref(date, query_id, keyword, model_id), fields, merge=True)
+            batch.commit()
+
+        for r in rows:
+            key = (_as_naive(r['tracked_at']).strftime('%Y-%m-%d'), r.get('query_id'), r.get('keyword'),
+                   r.get('model_id'))
+            domains = indexed.get(r['result_id'], set())
+            # Borrado + agregado (si es nuevo en el batch) + hasta 7 escrituras por dominio
+            needed = 1 + (0 if key in aggregates else 1) + len(domains) * (2 + len(SOURCE_FIELDS))
+            if writes + needed > SOURCE_BATCH_WRITES:
+                flush()
+                batch = db.batch()
+                aggregates = {}
+                writes = 0
+
+            if key not in aggregates:
+                aggregates[key] = {'results': 0, 'mentions': 0, 'visibility_sum': 0,
+                                   'position_sum': 0, 'position_count': 0}
+                writes += 1
+            counts = aggregates[key]
+            visibility = r.get('visibility') or 0
+            counts['results'] += 1
+            counts['mentions'] += 1 if visibility > 0 else 0
+            counts['visibility_sum'] += visibility
+            if r.get('position') is not None:
+                counts['position_sum'] += r['position']
+                counts['position_count'] += 1
+
+            if domains:
+                writes += remove_from_source_index(batch, r, domains)
+            batch.delete(db.collection('tracking_results').document(r['result_id']))
+            writes += 1
+        flush()
+
+        dropped += len(rows)
+        if job is not None:
+            job['processed'] += len(rows)
+
+    return dropped
+
+def run_retention(job=None):
+    """Aplica la política de retención: termina borrados pendientes, compacta resultados
+    y purga la cola de trabajo"""
+    resumed = resume_deleted_queries(job=job)
+    compacted = compact_old_results(job=job)
+    dropped = aggregate_expired_results(job=job)
+    purged = 0
+    if TRACKING_MODE == 'queue':
+        try:
+            queue = work_queue.connect()
+            try:
+                purged = queue.purge(QUEUE_RETENTION_DAYS * 86400)
+            finally:
+                queue.close()
+        except Exception as e:
+            print(f"Error purgando la cola de trabajo: {e}")
+    print(f"Retención: {resumed} borrados retomados, {compacted} resultados compactados, "
+          f"{dropped} agregados por día, {purged} work items purgados")
+    return compacted, purged
+
+@app.route('/api/maintenance/retention', methods=['POST'])
+def trigger_retention():
+    """Lanza la compactación/retención en segundo plano"""
+    job = start_maintenance_job('retention', run_retention)
+    return jsonify({'job_id': job['id'], 'message': 'Retención iniciada'}), 202
+
+@app.route('/api/maintenance/jobs/<job_id>', methods=['GET'])
+def get_maintenance_job(job_id):
+    """Estado de una tarea de mantenimiento"""
+    job = _maintenance_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Tarea no encontrada'}), 404
+    return jsonify(job)
+
+
+def print_startup_report(limit=20):
+    """Importa app.py en un proceso limpio con -X importtime y agrupa el coste por paquete"""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    totals = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        totals[package] = totals.get(package, 0) + int(self_us)
+
+    total = sum(totals.values())
+    print(f"Import de app.py: {total / 1e6:.3f}s")
+    for package, us in sorted(totals.items(), key=lambda x: x[1], reverse=True)[:limit]:
+        print(f"  {package:<30} {us / 1e6:8.3f}s  {us * 100 / total:5.1f}%")
+
+
+_startup_seconds = round(time.perf_counter() - _startup_begin, 4)
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    if sys.argv[1:] == ['startup-report']:
+        print_startup_report()
+    elif sys.argv[1:] == ['retention']:
+        # Para ejecutar la retención desde cron sin pasar por la API
+        run_retention()
+    else:
+        app.run(debug=True, port=5000)
 
@@ -139,18 +139,33 @@ async function deleteQuery(id) {
     }
 }
 
+// Queries with a tracking request in flight (avoids duplicate runs from double clicks)
+const trackingInFlight = new Set();
+
 async function trackNow(id) {
+    if (trackingInFlight.has(id)) {
+        alert('Tracking is already running for this query');
+        return;
+    }
     if (!confirm('Start tracking for this query now?')) return;
+    trackingInFlight.add(id);
     try {
         const response = await fetch(`${API_BASE}/api/queries/${id}/track`, {
             method: 'POST'
         });
 
         const data = await response.json();
-        alert(data.message || 'Tracking started');
+        if (response.status === 429) {
+            const retryAfter = response.headers.get('Retry-After');
+            alert(`Tracking is busy, try again in ${retryAfter || 'a few'} seconds`);
+            return;
+        }
+        alert(data.message || data.error || 'Tracking started');
     } catch (error) {
         console.error('Error tracking:', error);
         alert('Error starting tracking');
+    } finally {
+        trackingInFlight.delete(id);
     }
 }
 
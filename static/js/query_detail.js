@@ -49,13 +49,13 @@ async function loadQuery() {
     }
 }
 
-// Cargar resultados de tracking
+// Cargar resultados de tracking (tabla materializada por pregunta, keyword y modelo)
 async function loadTrackingResults() {
     try {
-        console.log(`Sending GET request to /api/queries/${queryId}/results`);
-        const response = await fetch(`${API_BASE}/api/queries/${queryId}/results`);
+        console.log(`Sending GET request to /api/queries/${queryId}/performance`);
+        const response = await fetch(`${API_BASE}/api/queries/${queryId}/performance`);
         trackingResults = await response.json();
-        console.log('Response from /api/queries/' + queryId + '/results:', trackingResults);
+        console.log('Response from /api/queries/' + queryId + '/performance:', trackingResults);
         renderQueryContent();
     } catch (error) {
         console.error('Error cargando resultados de tracking:', error);
@@ -110,21 +110,22 @@ function renderQueryContent() {
                 <div class="model-result">
                     <div class="model-result-header">${escapeHtml(modelName)}</div>
                     ${keywords.map(keyword => {
-                // Buscar resultado más reciente para esta pregunta, keyword y modelo
-                const result = trackingResults
-                    .filter(r =>
-                        r.question_text === question.text &&
-                        r.keyword === keyword &&
-                        r.model_id === modelId
-                    )
-                    .sort((a, b) => new Date(b.tracked_at) - new Date(a.tracked_at))[0];
-
-                const position = result && result.position !== null
-                    ? result.position.toFixed(2)
+                // Fila materializada para esta pregunta, keyword y modelo
+                const result = trackingResults.find(r =>
+                    r.question_text === question.text &&
+                    r.keyword === keyword &&
+                    r.model_id === modelId
+                );
+
+                const position = result && result.latest_position !== null
+                    ? result.latest_position.toFixed(2)
                     : 'Sin datos';
-                const visibility = result && result.visibility !== null
-                    ? `${result.visibility.toFixed(2)}%`
+                const visibility = result && result.latest_visibility !== null
+                    ? `${result.latest_visibility.toFixed(2)}%`
                     : 'Pendiente';
+                const change = result && result.position_change_24h !== null && result.position_change_24h !== undefined
+                    ? `${result.position_change_24h > 0 ? '+' : ''}${result.position_change_24h}`
+                    : '-';
 
                 return `
                             <div style="margin-bottom: 0.75rem;">
@@ -137,7 +138,7 @@ function renderQueryContent() {
                                     </div>
                                     <div class="metric-item">
                                         <div class="metric-label">Cambio 24h</div>
-                                        <div class="metric-value">-</div>
+                                        <div class="metric-value">${change}</div>
                                     </div>
                                     <div class="metric-item">
                                         <div class="metric-label">Visibilidad</div>
@@ -145,10 +146,10 @@ function renderQueryContent() {
                                     </div>
                                     <div class="metric-item" style="display: flex; gap: 0.5rem; justify-content: flex-end; align-items: flex-end;">
                                         ${result ? `
-                                            <button class="btn btn-icon-small" title="Ver Fuentes" onclick="showSources('${escapeHtml(modelName)}', ${JSON.stringify(result.sources || []).replace(/"/g, '&quot;')})" style="background: #f1f5f9; color: #475569; width: auto; padding: 0.25rem 0.5rem; font-size: 0.7rem;">
+                                            <button class="btn btn-icon-small" title="Ver Fuentes" onclick="showSources('${escapeHtml(modelName)}', ${JSON.stringify(result.latest_sources || []).replace(/"/g, '&quot;')})" style="background: #f1f5f9; color: #475569; width: auto; padding: 0.25rem 0.5rem; font-size: 0.7rem;">
                                                 🔗 Fuentes
                                             </button>
-                                            <button class="btn btn-icon-small" title="Ver Competidores (Respuesta Completa)" onclick="showRanking('${escapeHtml(modelName)}', ${JSON.stringify(result.response_text || '').replace(/"/g, '&quot;')})" style="background: #f1f5f9; color: #475569; width: auto; padding: 0.25rem 0.5rem; font-size: 0.7rem;">
+                                            <button class="btn btn-icon-small" title="Ver Competidores (Respuesta Completa)" onclick="showRankingForResult('${escapeHtml(modelName)}', '${result.latest_result_id}')" style="background: #f1f5f9; color: #475569; width: auto; padding: 0.25rem 0.5rem; font-size: 0.7rem;">
                                                 🏆 Ranking
                                             </button>
                                         ` : ''}
@@ -227,7 +228,15 @@ async function trackQuery() {
 
         console.log('Respuesta recibida:', response.status);
 
-        if (response.ok) {
+        if (response.status === 202) {
+            // Ya había un tracking en curso (o se ha encolado): no hay resultados todavía
+            const result = await response.json();
+            alert(result.message || 'Tracking en curso');
+            buttons.forEach((btn, index) => {
+                btn.disabled = false;
+                btn.innerHTML = originalTexts[index];
+            });
+        } else if (response.ok) {
             const result = await response.json();
             console.log('--- Tracking Response Data ---');
             console.log(result);
@@ -328,6 +337,21 @@ function showSources(modelName, sources) {
     showModal(`Fuentes - ${modelName}`, content);
 }
 
+// La respuesta completa no viaja en la tabla; se pide al abrir el modal
+async function showRankingForResult(modelName, resultId) {
+    try {
+        const response = await fetch(`${API_BASE}/api/results/${resultId}`);
+        const result = await response.json();
+        const text = result.body_removed
+            ? 'La respuesta completa se eliminó por la política de retención.'
+            : (result.response_text || '');
+        showRanking(modelName, text);
+    } catch (error) {
+        console.error('Error cargando resultado:', error);
+        alert('Error al cargar la respuesta');
+    }
+}
+
 function showRanking(modelName, responseText) {
     const content = `
         <div style="background: #f8fafc; padding: 1rem; border-radius: 0.5rem; font-family: monospace; white-space: pre-wrap; font-size: 0.85rem; max-height: 60vh; overflow-y: auto; border: 1px solid #e2e8f0;">
@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+"""
+Cola de trabajo compartida para los workers de tracking
+
+Cada work item se entrega al menos una vez: un worker lo reserva con un lease
+y, si no lo confirma (ack) antes de que expire, otro worker lo vuelve a tomar.
+
+Hay dos backends con la misma interfaz, elegidos con WORK_QUEUE_BACKEND:
+
+- sqlite (por defecto): un fichero en modo WAL. Solo sirve para procesos de un
+  mismo host con el fichero en un disco local (WAL no funciona en NFS/SMB).
+- redis: un servidor Redis (o compatible: Valkey, KeyDB...) en WORK_QUEUE_URL.
+  Sirve para workers en varias máquinas y para despliegues sin disco escribible
+  como Vercel.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+QUEUE_BACKEND = os.getenv("WORK_QUEUE_BACKEND", "sqlite").lower()
+QUEUE_PATH = os.getenv("WORK_QUEUE_PATH", "work_queue.db")
+QUEUE_URL = os.getenv("WORK_QUEUE_URL", "redis://localhost:6379/0")
+QUEUE_PREFIX = os.getenv("WORK_QUEUE_PREFIX", "ia_tracking:queue:")
+LEASE_SECONDS = float(os.getenv("WORK_LEASE_SECONDS", "300"))
+MAX_ATTEMPTS = int(os.getenv("WORK_MAX_ATTEMPTS", "3"))
+# Espera antes de reintentar un item fallido: RETRY_BASE * 2^(intentos - 1), hasta RETRY_MAX
+RETRY_BASE_SECONDS = float(os.getenv("WORK_RETRY_BASE_SECONDS", "30"))
+RETRY_MAX_SECONDS = float(os.getenv("WORK_RETRY_MAX_SECONDS", "900"))
+
+STATUSES = ('pending', 'leased', 'done', 'dead')
+
+
+def connect(backend=None):
+    """Abre la cola del backend configurado. Una conexión por hilo/proceso."""
+    backend = (backend or QUEUE_BACKEND).lower()
+    if backend == 'sqlite':
+        return SQLiteQueue(QUEUE_PATH)
+    if backend == 'redis':
+        return RedisQueue(QUEUE_URL, QUEUE_PREFIX)
+    raise ValueError(f"WORK_QUEUE_BACKEND no soportado: {backend}")
+
+
+def retry_delay(attempts):
+    """Backoff exponencial tras el intento número `attempts`"""
+    return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+
+
+def dedupe_key(query_id, item):
+    return json.dumps([query_id, item['model_id'], item['prompt']])
+
+
+class WorkQueue:
+    """Interfaz común de los backends de la cola"""
+
+    def enqueue(self, query_id, items, competitors=None):
+        """Encola work items de una query. Devuelve (encolados, omitidos).
+
+        Un item cuyo (query, modelo, prompt) ya está pendiente o en curso se omite,
+        así que encolar dos veces la misma query no duplica llamadas.
+        """
+        raise NotImplementedError
+
+    def claim(self, worker_id, limit=1):
+        """Reserva hasta `limit` items pendientes (o con el lease caducado)"""
+        raise NotImplementedError
+
+    def ack(self, item_id, worker_id):
+        """Marca un item como completado (solo si el lease sigue siendo nuestro)"""
+        raise NotImplementedError
+
+    def nack(self, item_id, worker_id, error):
+        """Devuelve un item fallido a la cola con backoff, o lo marca como 'dead' si agotó sus intentos"""
+        raise NotImplementedError
+
+    def release(self, item_id, worker_id, delay, error=None):
+        """Devuelve un item a la cola sin gastar el intento (p. ej. breaker abierto).
+
+        No se vuelve a reservar hasta pasados `delay` segundos.
+        """
+        raise NotImplementedError
+
+    def stats(self, query_id=None):
+        """Número de items por estado (opcionalmente de una query)"""
+        raise NotImplementedError
+
+    def purge(self, older_than_seconds):
+        """Borra los items terminados ('done' o 'dead') más antiguos que el umbral"""
+        raise NotImplementedError
+
+    def cancel_query(self, query_id):
+        """Descarta los items pendientes de una query (p. ej. al eliminarla)"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_items (
+    id TEXT PRIMARY KEY,
+    query_id TEXT NOT NULL,
+    dedupe_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending', -- pending | leased | done | dead
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    not_before REAL, -- no se reserva antes de este momento (backoff)
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_work_items_status ON work_items (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_work_items_dedupe ON work_items (dedupe_key, status);
+"""
+
+
+class SQLiteQueue(WorkQueue):
+    """Cola en un fichero SQLite (WAL) para procesos de un mismo host"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(work_items)")}
+        if 'not_before' not in columns:
+            # Colas creadas antes de que existiera el backoff
+            self.conn.execute("ALTER TABLE work_items ADD COLUMN not_before REAL")
+
+    def enqueue(self, query_id, items, competitors=None):
+        now = time.time()
+        enqueued = 0
+        skipped = 0
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for item in items:
+                key = dedupe_key(query_id, item)
+                exists = self.conn.execute(
+                    "SELECT 1 FROM work_items WHERE dedupe_key = ? AND status IN ('pending', 'leased')",
+                    (key,)
+                ).fetchone()
+                if exists:
+                    skipped += 1
+                    continue
+                payload = json.dumps({'item': item, 'competitors': competitors or []})
+                self.conn.execute(
+                    "INSERT INTO work_items (id, query_id, dedupe_key, payload, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (uuid.uuid4().hex, query_id, key, payload, now, now)
+                )
+                enqueued += 1
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return enqueued, skipped
+
+    def claim(self, worker_id, limit=1):
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Los items que agotaron sus intentos y perdieron el lease pasan a 'dead'
+            self.conn.execute(
+                "UPDATE work_items SET status = 'dead', updated_at = ?, "
+                "last_error = COALESCE(last_error, 'Lease caducado') "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, MAX_ATTEMPTS)
+            )
+            rows = self.conn.execute(
+                "SELECT id, query_id, payload FROM work_items "
+                "WHERE (status = 'pending' AND (not_before IS NULL OR not_before <= ?)) "
+                "OR (status = 'leased' AND lease_expires < ?) "
+                "ORDER BY created_at LIMIT ?",
+                (now, now, limit)
+            ).fetchall()
+            for row in rows:
+                self.conn.execute(
+                    "UPDATE work_items SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (worker_id, now + LEASE_SECONDS, now, row['id'])
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        return [
+            {'id': row['id'], 'query_id': row['query_id'], 'payload': json.loads(row['payload'])}
+            for row in rows
+        ]
+
+    def ack(self, item_id, worker_id):
+        self.conn.execute(
+            "UPDATE work_items SET status = 'done', lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ?",
+            (time.time(), item_id, worker_id)
+        )
+
+    def nack(self, item_id, worker_id, error):
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT attempts FROM work_items WHERE id = ? AND lease_owner = ?",
+                (item_id, worker_id)
+            ).fetchone()
+            if row:
+                self.conn.execute(
+                    "UPDATE work_items SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'pending' END, "
+                    "lease_owner = NULL, lease_expires = NULL, not_before = ?, last_error = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (MAX_ATTEMPTS, now + retry_delay(row['attempts']), str(error), now, item_id)
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def release(self, item_id, worker_id, delay, error=None):
+        now = time.time()
+        self.conn.execute(
+            "UPDATE work_items SET status = 'pending', attempts = MAX(0, attempts - 1), "
+            "lease_owner = NULL, lease_expires = NULL, not_before = ?, "
+            "last_error = COALESCE(?, last_error), updated_at = ? "
+            "WHERE id = ? AND lease_owner = ?",
+            (now + delay, None if error is None else str(error), now, item_id, worker_id)
+        )
+
+    def stats(self, query_id=None):
+        if query_id:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) AS n FROM work_items WHERE query_id = ? GROUP BY status",
+                (query_id,)
+            ).fetchall()
+        else:
+            rows = self.conn.execute("SELECT status, COUNT(*) AS n FROM work_items GROUP BY status").fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        for row in rows:
+            counts[row['status']] = row['n']
+        return counts
+
+    def purge(self, older_than_seconds):
+        cursor = self.conn.execute(
+            "DELETE FROM work_items WHERE status IN ('done', 'dead') AND updated_at < ?",
+            (time.time() - older_than_seconds,)
+        )
+        return cursor.rowcount
+
+    def cancel_query(self, query_id):
+        cursor = self.conn.execute(
+            "DELETE FROM work_items WHERE query_id = ? AND status = 'pending'",
+            (query_id,)
+        )
+        return cursor.rowcount
+
+    def close(self):
+        self.conn.close()
+
+
+# Scripts Lua del backend Redis: cada operación sobre un item es atómica en el
+# servidor. Las claves de los items se construyen dentro del script, así que se
+# necesita un único servidor (no Redis Cluster).
+#
+#   {prefix}item:{id}      hash con los campos del item
+#   {prefix}pending        zset id -> momento en que se puede reservar (backoff)
+#   {prefix}leased         zset id -> vencimiento del lease
+#   {prefix}done/dead      zset id -> momento en que terminó
+#   {prefix}dedupe         hash dedupe_key -> id (solo items pendientes o en curso)
+#   {prefix}query:{qid}    set con los ids de una query
+
+_ENQUEUE_LUA = """
+local prefix = ARGV[1]
+if redis.call('HEXISTS', prefix .. 'dedupe', ARGV[2]) == 1 then
+    return 0
+end
+redis.call('HSET', prefix .. 'dedupe', ARGV[2], ARGV[3])
+redis.call('HSET', prefix .. 'item:' .. ARGV[3],
+    'query_id', ARGV[4], 'dedupe_key', ARGV[2], 'payload', ARGV[5],
+    'status', 'pending', 'attempts', 0, 'lease_owner', '', 'last_error', '',
+    'created_at', ARGV[6], 'updated_at', ARGV[6])
+redis.call('ZADD', prefix .. 'pending', ARGV[6], ARGV[3])
+redis.call('SADD', prefix .. 'query:' .. ARGV[4], ARGV[3])
+return 1
+"""
+
+_CLAIM_LUA = """
+local prefix = ARGV[1]
+local now = tonumber(ARGV[2])
+local max_attempts = tonumber(ARGV[5])
+-- Los leases caducados vuelven a la cola, o a 'dead' si agotaron sus intentos
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', prefix .. 'leased', '-inf', now)) do
+    local key = prefix .. 'item:' .. id
+    redis.call('ZREM', prefix .. 'leased', id)
+    if tonumber(redis.call('HGET', key, 'attempts') or '0') >= max_attempts then
+        if redis.call('HGET', key, 'last_error') == '' then
+            redis.call('HSET', key, 'last_error', 'Lease caducado')
+        end
+        redis.call('HSET', key, 'status', 'dead', 'lease_owner', '', 'updated_at', now)
+        redis.call('ZADD', prefix .. 'dead', now, id)
+        redis.call('HDEL', prefix .. 'dedupe', redis.call('HGET', key, 'dedupe_key'))
+    else
+        redis.call('HSET', key, 'status', 'pending', 'lease_owner', '')
+        redis.call('ZADD', prefix .. 'pending', now, id)
+    end
+end
+local ids = redis.call('ZRANGEBYSCORE', prefix .. 'pending', '-inf', now, 'LIMIT', 0, tonumber(ARGV[3]))
+local claimed = {}
+for _, id in ipairs(ids) do
+    local key = prefix .. 'item:' .. id
+    redis.call('ZREM', prefix .. 'pending', id)
+    redis.call('ZADD', prefix .. 'leased', now + tonumber(ARGV[4]), id)
+    redis.call('HSET', key, 'status', 'leased', 'lease_owner', ARGV[6], 'updated_at', now)
+    redis.call('HINCRBY', key, 'attempts', 1)
+    table.insert(claimed, {id, redis.call('HGET', key, 'query_id'), redis.call('HGET', key, 'payload')})
+end
+return claimed
+"""
+
+_ACK_LUA = """
+local prefix = ARGV[1]
+local key = prefix .. 'item:' .. ARGV[2]
+if redis.call('HGET', key, 'lease_owner') ~= ARGV[3] then
+    return 0
+end
+redis.call('ZREM', prefix .. 'leased', ARGV[2])
+redis.call('HSET', key, 'status', 'done', 'lease_owner', '', 'updated_at', ARGV[4])
+redis.call('ZADD', prefix .. 'done', ARGV[4], ARGV[2])
+redis.call('HDEL', prefix .. 'dedupe', redis.call('HGET', key, 'dedupe_key'))
+return 1
+"""
+
+_NACK_LUA = """
+local prefix = ARGV[1]
+local key = prefix .. 'item:' .. ARGV[2]
+if redis.call('HGET', key, 'lease_owner') ~= ARGV[3] then
+    return 0
+end
+local now = tonumber(ARGV[5])
+redis.call('ZREM', prefix .. 'leased', ARGV[2])
+redis.call('HSET', key, 'lease_owner', '', 'last_error', ARGV[4], 'updated_at', now)
+local attempts = tonumber(redis.call('HGET', key, 'attempts'))
+if attempts >= tonumber(ARGV[6]) then
+    redis.call('HSET', key, 'status', 'dead')
+    redis.call('ZADD', prefix .. 'dead', now, ARGV[2])
+    redis.call('HDEL', prefix .. 'dedupe', redis.call('HGET', key, 'dedupe_key'))
+else
+    local delay = math.min(tonumber(ARGV[8]), tonumber(ARGV[7]) * 2 ^ math.max(0, attempts - 1))
+    redis.call('HSET', key, 'status', 'pending')
+    redis.call('ZADD', prefix .. 'pending', now + delay, ARGV[2])
+end
+return 1
+"""
+
+_RELEASE_LUA = """
+local prefix = ARGV[1]
+local key = prefix .. 'item:' .. ARGV[2]
+if redis.call('HGET', key, 'lease_owner') ~= ARGV[3] then
+    return 0
+end
+local now = tonumber(ARGV[4])
+redis.call('ZREM', prefix .. 'leased', ARGV[2])
+if tonumber(redis.call('HGET', key, 'attempts')) > 0 then
+    redis.call('HINCRBY', key, 'attempts', -1)
+end
+if ARGV[6] ~= '' then
+    redis.call('HSET', key, 'last_error', ARGV[6])
+end
+redis.call('HSET', key, 'status', 'pending', 'lease_owner', '', 'updated_at', now)
+redis.call('ZADD', prefix .. 'pending', now + tonumber(ARGV[5]), ARGV[2])
+return 1
+"""
+
+_CANCEL_LUA = """
+local prefix = ARGV[1]
+local removed = 0
+for _, id in ipairs(redis.call('SMEMBERS', prefix .. 'query:' .. ARGV[2])) do
+    local key = prefix .. 'item:' .. id
+    if redis.call('HGET', key, 'status') == 'pending' then
+        redis.call('ZREM', prefix .. 'pending', id)
+        redis.call('HDEL', prefix .. 'dedupe', redis.call('HGET', key, 'dedupe_key'))
+        redis.call('DEL', key)
+        redis.call('SREM', prefix .. 'query:' .. ARGV[2], id)
+        removed = removed + 1
+    end
+end
+return removed
+"""
+
+_PURGE_LUA = """
+local prefix = ARGV[1]
+local removed = 0
+for _, status in ipairs({'done', 'dead'}) do
+    for _, id in ipairs(redis.call('ZRANGEBYSCORE', prefix .. status, '-inf', ARGV[2], 'LIMIT', 0, 500)) do
+        local key = prefix .. 'item:' .. id
+        local query_id = redis.call('HGET', key, 'query_id')
+        if query_id then
+            redis.call('SREM', prefix .. 'query:' .. query_id, id)
+        end
+        redis.call('DEL', key)
+        redis.call('ZREM', prefix .. status, id)
+        removed = removed + 1
+    end
+end
+return removed
+"""
+
+
+class RedisQueue(WorkQueue):
+    """Cola en un servidor Redis (o compatible) compartido por varios hosts"""
+
+    def __init__(self, url, prefix):
+        import redis  # solo hace falta con este backend
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._enqueue = self.client.register_script(_ENQUEUE_LUA)
+        self._claim = self.client.register_script(_CLAIM_LUA)
+        self._ack = self.client.register_script(_ACK_LUA)
+        self._nack = self.client.register_script(_NACK_LUA)
+        self._release = self.client.register_script(_RELEASE_LUA)
+        self._cancel = self.client.register_script(_CANCEL_LUA)
+        self._purge = self.client.register_script(_PURGE_LUA)
+
+    def enqueue(self, query_id, items, competitors=None):
+        now = time.time()
+        enqueued = 0
+        skipped = 0
+        for item in items:
+            payload = json.dumps({'item': item, 'competitors': competitors or []})
+            added = self._enqueue(args=[self.prefix, dedupe_key(query_id, item), uuid.uuid4().hex,
+                                        query_id, payload, now])
+            if added:
+                enqueued += 1
+            else:
+                skipped += 1
+        return enqueued, skipped
+
+    def claim(self, worker_id, limit=1):
+        rows = self._claim(args=[self.prefix, time.time(), limit, LEASE_SECONDS, MAX_ATTEMPTS, worker_id])
+        return [
+            {'id': item_id, 'query_id': query_id, 'payload': json.loads(payload)}
+            for item_id, query_id, payload in rows
+        ]
+
+    def ack(self, item_id, worker_id):
+        self._ack(args=[self.prefix, item_id, worker_id, time.time()])
+
+    def nack(self, item_id, worker_id, error):
+        self._nack(args=[self.prefix, item_id, worker_id, str(error), time.time(), MAX_ATTEMPTS,
+                         RETRY_BASE_SECONDS, RETRY_MAX_SECONDS])
+
+    def release(self, item_id, worker_id, delay, error=None):
+        self._release(args=[self.prefix, item_id, worker_id, time.time(), delay,
+                            '' if error is None else str(error)])
+
+    def stats(self, query_id=None):
+        if not query_id:
+            pipe = self.client.pipeline()
+            for status in STATUSES:
+                pipe.zcard(self.prefix + status)
+            return dict(zip(STATUSES, pipe.execute()))
+
+        counts = dict.fromkeys(STATUSES, 0)
+        ids = self.client.smembers(f"{self.prefix}query:{query_id}")
+        pipe = self.client.pipeline()
+        for item_id in ids:
+            pipe.hget(f"{self.prefix}item:{item_id}", 'status')
+        for status in pipe.execute():
+            if status in counts:
+                counts[status] += 1
+        return counts
+
+    def purge(self, older_than_seconds):
+        cutoff = time.time() - older_than_seconds
+        purged = 0
+        # Por tandas para no bloquear el servidor con un único script largo
+        while True:
+            removed = self._purge(args=[self.prefix, cutoff])
+            purged += removed
+            if not removed:
+                return purged
+
+    def cancel_query(self, query_id):
+        return self._cancel(args=[self.prefix, query_id])
+
+    def close(self):
+        self.client.close()
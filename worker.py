@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Worker de tracking: consume work items de la cola compartida
+
+Uso:
+    python -m worker                  # un proceso
+    python -m worker --processes 4    # varios procesos en este host
+
+Con WORK_QUEUE_BACKEND=sqlite (por defecto) la cola es un fichero en modo WAL: el
+servidor y todos los workers deben estar en el mismo host y WORK_QUEUE_PATH en
+un disco local. Para repartir workers entre máquinas (o con el servidor en
+Vercel) usa WORK_QUEUE_BACKEND=redis y WORK_QUEUE_URL.
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+
+import work_queue
+
+POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "2"))
+
+
+def run_worker(poll_interval=POLL_INTERVAL, once=False):
+    """Bucle principal de un proceso worker"""
+    # Importamos app aquí para que cada proceso inicialice sus propios clientes
+    from app import execute_work_item
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    queue = work_queue.connect()
+    print(f"Worker {worker_id} iniciado")
+
+    while True:
+        jobs = queue.claim(worker_id)
+        if not jobs:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        for job in jobs:
+            payload = job['payload']
+            try:
+                results = execute_work_item(job['query_id'], payload['item'], payload.get('competitors'))
+            except Exception as e:
+                print(f"Error procesando {job['id']}: {e}")
+                queue.nack(job['id'], worker_id, e)
+                continue
+
+            # Si fallaron todos los targets es que falló la llamada al modelo: reintentamos
+            if results and all(not r['success'] for r in results):
+                if results[0].get('provider_unavailable'):
+                    # Breaker abierto: no se llegó a llamar, esperamos a que acabe el cooldown
+                    delay = results[0].get('retry_after') or work_queue.RETRY_BASE_SECONDS
+                    queue.release(job['id'], worker_id, delay, results[0].get('error'))
+                else:
+                    queue.nack(job['id'], worker_id, results[0].get('error'))
+            else:
+                queue.ack(job['id'], worker_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker de tracking")
+    parser.add_argument("--processes", type=int, default=1, help="Número de procesos worker")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL,
+                        help="Segundos de espera cuando la cola está vacía")
+    parser.add_argument("--once", action="store_true", help="Salir cuando la cola esté vacía")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_worker(args.poll_interval, args.once)
+        return
+
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(args.poll_interval, args.once))
+        for _ in range(args.processes)
+    ]
+    for p in processes:
+        p.start()
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        for p in processes:
+            p.terminate()
+
+
+if __name__ == '__main__':
+    main()